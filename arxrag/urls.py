@@ -18,12 +18,13 @@ from django.contrib import admin
 from django.urls import path
 from rag.views import ask
 from rag.agent import agent_search_ingest, agent_ask
-from rag.views import home
+from rag.views import home, chunk_content
 
 urlpatterns = [
     path("", home),
     path("admin/", admin.site.urls),
     path("api/ask", ask),
+    path("api/chunks/<int:chunk_id>", chunk_content),
     path("api/agent/search_ingest", agent_search_ingest),
     path("api/agent/ask", agent_ask),
 ]
@@ -0,0 +1,8 @@
+# Loaded automatically by `gunicorn arxrag.wsgi` when started from this directory.
+
+
+def post_worker_init(worker):
+    # warm each worker after it has loaded the app (safe with --preload: the
+    # master never starts the warm-up thread, so no lock is held across fork)
+    from rag.apps import start_warm
+    start_warm()
@@ -1,6 +1,7 @@
 # Register your models here.
 from django.contrib import admin
-from .models import Document, Chunk, QueryLog
+from .models import Document, Chunk, QueryLog, SavedQuery
 admin.site.register(Document)
 admin.site.register(Chunk)
 admin.site.register(QueryLog)
+admin.site.register(SavedQuery)
@@ -2,31 +2,39 @@
 
 Implements two REST endpoints (wired in urls.py):
  POST /api/agent/search_ingest  {"query":"...", "max_results": N}
-   -> runs ingest_arxiv(query, max_results)
- POST /api/agent/ask            {"question":"...", "k": K}
-   -> runs RAG answer using existing retrieval.answer
+   -> runs ingest_arxiv(query, max_results); already-ingested papers are skipped
+ POST /api/agent/ask            {"question":"...", "k": K, "per_doc_cap": N, "arxiv_ids": [...],
+                                 "kinds": [...], "added_after": "...", "authors": [...]}
+   -> runs RAG answer using existing retrieval.answer (filters optional;
+      "lean": true returns chunk ids + snippets, full text via GET /api/chunks/<id>)
 
 Keeps implementation lightweight (no async tool orchestration yet).
 """
 
+import time
+
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 
-from .serializers import ArxivFetchIn, AskIn, ChunkOut
+from .serializers import ArxivFetchIn, AskIn, contexts_out
 from .ingest import ingest_arxiv
 from .retrieval import answer as rag_answer
+from .llm import LLMError
 
 @api_view(["POST"])
 def agent_search_ingest(request):
   s = ArxivFetchIn(data=request.data)
   s.is_valid(raise_exception=True)
   data = s.validated_data
+  t0 = time.time()
   try:
-    ingest_arxiv(query=data["query"], max_results=data["max_results"])
+    summary = ingest_arxiv(query=data["query"], max_results=data["max_results"])
   except Exception as e:
     return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-  return Response({"status": "ok", "query": data["query"], "ingested": data["max_results"]})
+  return Response({"status": "ok", "query": data["query"],
+                   "ingested": len(summary["added"]) + len(summary["updated"]), **summary,
+                   "meta": {"timings": {"total_s": round(time.time() - t0, 4)}}})
 
 @api_view(["POST"])
 def agent_ask(request):
@@ -35,8 +43,11 @@ def agent_ask(request):
   q = s.validated_data["question"]
   k = s.validated_data["k"]
   try:
-    result, ctxs = rag_answer(q, k)
+    result, ctxs = rag_answer(q, k, per_doc_cap=s.validated_data.get("per_doc_cap"), **s.search_filters())
+  except LLMError as e:
+    return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
   except Exception as e:
     return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-  return Response({"answer": result["answer"], "meta": result.get("meta", {}), "contexts": ChunkOut(ctxs, many=True).data})
+  return Response({"answer": result["answer"], "meta": result.get("meta", {}),
+                   "contexts": contexts_out(ctxs, lean=s.validated_data["lean"])})
 
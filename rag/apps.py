@@ -1,6 +1,54 @@
+import os, sys, threading
 from django.apps import AppConfig
 
+WARM_START = os.environ.get("ARXRAG_WARM_START", "1") != "0"
+
+_warm_lock = threading.Lock()
+_warmed_pid = None
+
 
 class RagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag'
+
+    def ready(self):
+        # Warm-up runs once per serving process, never in a process that may still
+        # fork (gunicorn master with --preload, the runserver autoreloader parent):
+        # a thread holding a lock at fork time would deadlock the child.
+        if not WARM_START:
+            return
+        if os.path.basename(sys.argv[0]) == "manage.py":
+            if sys.argv[1:2] != ["runserver"]:
+                return
+            if os.environ.get("RUN_MAIN") == "true":  # the reloader's serving child
+                start_warm()
+                return
+        # WSGI servers: gunicorn.conf.py calls start_warm() in post_worker_init;
+        # anything else warms on its first request.
+        from django.core.signals import request_started
+        request_started.connect(_warm_on_request, dispatch_uid="rag-warm-start")
+
+
+def start_warm():
+    """Attach the retrieval snapshot / index in a background thread, once per process."""
+    global _warmed_pid
+    with _warm_lock:
+        if not WARM_START or _warmed_pid == os.getpid():
+            return
+        _warmed_pid = os.getpid()
+    threading.Thread(target=_warm, name="rag-warm-start", daemon=True).start()
+
+
+def _warm_on_request(sender, **kwargs):
+    start_warm()
+
+
+def _warm():
+    from django.db import connection
+    from . import retrieval
+    try:
+        retrieval.warm()
+    except Exception as e:  # missing index / unmigrated DB: the first request loads lazily instead
+        print("warm start skipped:", e)
+    finally:
+        connection.close()  # this thread's connection; it is not used again
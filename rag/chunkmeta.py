@@ -0,0 +1,95 @@
+"""Compact in-memory chunk metadata table used for filtered vector search.
+
+Row ``i`` of the table describes FAISS label ``i``: the table is built for the
+exact chunk id list saved next to the index (``ingest.IDS_PATH``) or stored in
+a snapshot, so a filter can be turned into a boolean row mask and handed to
+FAISS as an ID selector: excluded rows are skipped inside the index scan
+instead of being post-filtered out of a global top-k.
+
+The table is a handful of flat NumPy columns (a few bytes per chunk) and is
+rebuilt together with the index it describes.
+"""
+import re
+import numpy as np
+from .models import Chunk, Document
+
+KIND_CODES = {"text": 0, "image": 1}
+ID_BATCH = 500   # ids per IN (...) query (SQLite variable limit)
+_VERSION_RE = re.compile(r"v\d+$")
+
+
+def base_arxiv_id(arxiv_id):
+    """'2406.13249v2' -> '2406.13249' (ids without a version are returned unchanged)."""
+    return _VERSION_RE.sub("", arxiv_id or "")
+
+
+class ChunkMetaTable:
+    def __init__(self, chunk_ids, doc_ids, kinds, added_at, docs, signature=None):
+        self.chunk_ids = chunk_ids    # int64, ascending; row -> chunk id
+        self.doc_ids = doc_ids        # int64; row -> doc id
+        self.kinds = kinds            # int8 KIND_CODES; row -> kind
+        self.added_at = added_at      # float64 epoch seconds of the parent document
+        self.docs = docs              # doc id -> (arxiv_id, lowercased authors)
+        self.signature = signature
+
+    @classmethod
+    def build(cls, chunk_ids=None, signature=None):
+        """Table for ``chunk_ids`` (ascending; default: every Chunk).
+
+        Ids whose Chunk no longer exists get doc id -1 and kind -1: kind and
+        document filters never admit them and they resolve to no Chunk.
+        """
+        if chunk_ids is None:
+            rows = list(Chunk.objects.order_by("id").values_list("id", "doc_id", "kind"))
+        else:
+            chunk_ids = [int(c) for c in chunk_ids]
+            found = {}
+            for start in range(0, len(chunk_ids), ID_BATCH):
+                batch = chunk_ids[start:start + ID_BATCH]
+                found.update((r[0], r) for r in Chunk.objects.filter(id__in=batch).values_list("id", "doc_id", "kind"))
+            rows = [found.get(c, (c, -1, None)) for c in chunk_ids]
+        docs, doc_added = {}, {}
+        for did, arxiv_id, authors, added in Document.objects.values_list("id", "arxiv_id", "authors", "added_at"):
+            docs[did] = (arxiv_id or "", (authors or "").lower())
+            doc_added[did] = added.timestamp() if added else 0.0
+        n = len(rows)
+        chunk_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+        doc_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=n)
+        kinds = np.fromiter((KIND_CODES.get(r[2], -1) for r in rows), dtype=np.int8, count=n)
+        added_at = np.fromiter((doc_added.get(r[1], 0.0) for r in rows), dtype=np.float64, count=n)
+        return cls(chunk_ids, doc_ids, kinds, added_at, docs, signature=signature)
+
+    def __len__(self):
+        return int(self.chunk_ids.size)
+
+    def rows_for(self, chunk_ids):
+        """Map chunk ids to table rows (-1 for ids not in the table)."""
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        if not len(self):
+            return np.full(ids.shape, -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.chunk_ids, ids), 0, len(self) - 1)
+        return np.where(self.chunk_ids[pos] == ids, pos, -1)
+
+    def mask(self, arxiv_ids=None, kinds=None, added_after=None, authors=None):
+        """Boolean row mask for the given filters; ``None``/empty means "no constraint".
+
+        ``arxiv_ids`` match with or without the version suffix, ``authors`` are
+        case-insensitive substrings (any one matches) and ``added_after`` is a
+        datetime compared against ``Document.added_at``.
+        """
+        m = np.ones(len(self), dtype=bool)
+        if kinds:
+            m &= np.isin(self.kinds, [KIND_CODES.get(k, -2) for k in kinds])
+        if added_after is not None:
+            m &= self.added_at > added_after.timestamp()
+        if arxiv_ids or authors:
+            wanted = {a.strip() for a in (arxiv_ids or []) if a.strip()}
+            wanted |= {base_arxiv_id(a) for a in wanted}
+            needles = [a.strip().lower() for a in (authors or []) if a.strip()]
+            allowed = [
+                did for did, (aid, auth) in self.docs.items()
+                if (not wanted or aid in wanted or base_arxiv_id(aid) in wanted)
+                and (not needles or any(nd in auth for nd in needles))
+            ]
+            m &= np.isin(self.doc_ids, np.asarray(allowed, dtype=np.int64))
+        return m
@@ -0,0 +1,40 @@
+"""Inter-process exclusive locks for writers sharing files under ``data/``.
+
+Ingestion can run in several processes at once (gunicorn workers serving
+``/api/agent/search_ingest``, a ``sync_arxiv`` cron job, ``reingest``), so every
+read-modify-write of the vector store, the FAISS index or the serving
+directory holds an ``fcntl.flock`` on a lock file next to the data. Locks are
+re-entrant within a thread, so e.g. ``ingest_results`` can hold the index lock
+while calling ``rebuild_index``, which takes it again.
+"""
+import contextlib, fcntl, os, threading
+
+_held = threading.local()
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock on ``path`` (created if missing) for the ``with`` block."""
+    counts = getattr(_held, "counts", None)
+    if counts is None:
+        counts = _held.counts = {}
+    key = os.path.abspath(path)
+    if counts.get(key):
+        counts[key] += 1
+        try:
+            yield
+        finally:
+            counts[key] -= 1
+        return
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    fd = os.open(key, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        counts[key] = 1
+        try:
+            yield
+        finally:
+            counts[key] = 0
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
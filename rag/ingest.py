@@ -1,11 +1,15 @@
-import os, io, arxiv, numpy as np
-from pypdf import PdfReader
-from rapidfuzz.distance import Levenshtein
+import os, io, numpy as np
 from django.conf import settings
+from django.db import transaction
 from .models import Document, Chunk
-import faiss
+from . import filelock, llm, serving, vectorstore
+from .chunkmeta import base_arxiv_id
+# faiss, arxiv, pypdf and rapidfuzz are imported where used so a serving
+# worker that only answers from the retrieval snapshot never loads them.
 
 INDEX_PATH = "data/index/faiss_text.index"
+IDS_PATH = "data/index/faiss_text.ids.npy"   # FAISS row -> chunk id, saved with the index
+INDEX_LOCK = INDEX_PATH + ".lock"            # held by every writer of the index / Chunk rows
 DIM = 3072  # match your embedder
 
 def get_embedder():
@@ -14,14 +18,9 @@ def get_embedder():
     The OpenAI text-embedding-3-large model has an 8192 token context window PER request.
     We (roughly) treat whitespace-delimited words as tokens (fast, conservative) so we keep
     each item <= 8190 "tokens" and batch groups so their combined size does not exceed a
-    safety threshold (default 6000) to avoid 400 errors.
+    safety threshold (default 6000) to avoid 400 errors. Requests go through the
+    pooled client in ``rag.llm``.
     """
-    with open(os.path.expanduser("~/.openai_api_key_gpt5")) as f:
-        api_key = f.read().strip()
-    print("API KEY:", repr(api_key))  # debug (consider removing in prod)
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-
     MODEL = "text-embedding-3-large"
     PER_ITEM_LIMIT = 8190  # safety (model is 8192)
     BATCH_LIMIT = 6000     # approx total tokens per batch (heuristic)
@@ -41,25 +40,97 @@ def get_embedder():
             t_tok = len(t.split())
             # flush if adding would overflow batch heuristic
             if batch and batch_tok_count + t_tok > BATCH_LIMIT:
-                out = client.embeddings.create(model=MODEL, input=batch)
+                out = llm.embeddings(MODEL, batch)
                 all_vecs.extend(d.embedding for d in out.data)
                 batch = []
                 batch_tok_count = 0
             batch.append(t)
             batch_tok_count += t_tok
         if batch:
-            out = client.embeddings.create(model=MODEL, input=batch)
+            out = llm.embeddings(MODEL, batch)
             all_vecs.extend(d.embedding for d in out.data)
         return np.array(all_vecs, dtype="float32")
 
     return embed
 
+def load_index():
+    """``(index, chunk ids)`` as saved by ``save_index``; raises FileNotFoundError if there is none.
+
+    Indexes saved before the id file existed are mapped positionally to the
+    Chunks ordered by id, provided the row counts agree.
+    """
+    import faiss
+    for _ in range(3):
+        idx = faiss.read_index(INDEX_PATH)
+        if not os.path.exists(IDS_PATH):
+            ids = np.fromiter(Chunk.objects.order_by("id").values_list("id", flat=True), dtype=np.int64)
+        else:
+            ids = np.load(IDS_PATH)
+        if len(ids) == idx.ntotal:
+            return idx, ids
+        # a writer replaced the files between the two reads; read again
+    raise RuntimeError(f"{INDEX_PATH} has {idx.ntotal} rows but {len(ids)} chunk ids; run rebuild_index()")
+
 def load_or_new_index(d=DIM):
+    import faiss
     if os.path.exists(INDEX_PATH):
-        return faiss.read_index(INDEX_PATH)
-    idx = faiss.IndexFlatIP(d); return idx
+        return load_index()
+    return faiss.IndexFlatIP(d), np.zeros(0, dtype=np.int64)
+
+def save_index(idx, chunk_ids):
+    """Write the index and its row -> chunk id map (ids first; readers key on the index file)."""
+    import faiss
+    chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+    if len(chunk_ids) != idx.ntotal:
+        raise ValueError(f"{idx.ntotal} index rows but {len(chunk_ids)} chunk ids")
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    np.save(IDS_PATH + ".tmp.npy", chunk_ids)
+    os.replace(IDS_PATH + ".tmp.npy", IDS_PATH)
+    faiss.write_index(idx, INDEX_PATH + ".tmp")
+    os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+
+def rebuild_index(d=DIM):
+    """Rebuild the FAISS index from the vector store (no re-download / re-embedding).
+
+    Row i is the i-th Chunk ordered by id (the ids are saved with the index): chunks
+    without a ``d``-dimensional stored vector (e.g. CLIP image chunks) get a zero
+    placeholder row, which never outranks a real match and is excluded by kind filters.
+    The vector store is compacted to the live chunks first. Also publishes a new
+    retrieval snapshot.
+    """
+    import faiss
+    with filelock.locked(INDEX_LOCK):
+        chunk_ids = _chunk_ids()
+        vectorstore.compact(live_ids=chunk_ids)
+        ids, vecs = vectorstore.get_store(refresh=True).all_vectors(dim=d, chunk_ids=chunk_ids)
+        full = np.zeros((len(chunk_ids), d), dtype="float32")
+        full[np.searchsorted(chunk_ids, ids)] = vecs
+        idx = faiss.IndexFlatIP(d)
+        if len(full):
+            idx.add(full)
+        save_index(idx, chunk_ids)
+        serving.publish_from_index(idx, chunk_ids)
+    return idx
+
+def _chunk_ids():
+    return np.fromiter(Chunk.objects.order_by("id").values_list("id", flat=True), dtype=np.int64)
 
-def save_index(idx): faiss.write_index(idx, INDEX_PATH)
+def _load_current_index():
+    """``(index, chunk ids)`` covering exactly the committed Chunk rows; caller holds ``INDEX_LOCK``.
+
+    An index that disagrees with the database (a process died between its
+    commit and its index save, or an older writer raced it) is rebuilt first.
+    """
+    live = _chunk_ids()
+    try:
+        idx, ids = load_or_new_index()
+    except RuntimeError as e:  # legacy index whose row count no longer matches
+        print(e)
+    else:
+        if np.array_equal(ids, live):
+            return idx, ids
+        print(f"Index has {idx.ntotal} rows for {len(live)} chunks; rebuilding")
+    return rebuild_index(), live
 
 def chunk_text(pages, max_tokens=350, overlap=60):
     """Create semi-overlapping chunks constrained to max_tokens (approx words).
@@ -88,48 +159,123 @@ def chunk_text(pages, max_tokens=350, overlap=60):
     if window_tokens > 0:
         chunks.append(" ".join(window))
     # simple dedup using Levenshtein distance threshold
+    from rapidfuzz.distance import Levenshtein
     dedup = []
     for c in chunks:
         if not dedup or Levenshtein.distance(c, dedup[-1]) > 50:
             dedup.append(c)
     return dedup
 
+def split_arxiv_id(short_id):
+    """'2406.13249v2' -> ('2406.13249', 2); ids without a version suffix get version 1."""
+    base = base_arxiv_id(short_id)
+    suffix = short_id[len(base) + 1:]
+    return base, int(suffix) if suffix.isdigit() else 1
+
+def ingest_results(results):
+    """Upsert arXiv search results by (arxiv_id, version).
+
+    Papers whose stored version is already current are skipped before any PDF
+    parsing or embedding; a newer version replaces the old Document and its chunks.
+    Each paper is parsed and embedded first and then written (old version
+    deleted, new Document + chunks created, vectors stored) in one transaction,
+    so a failure leaves the previous version in place and the paper is retried
+    on the next run. The index is saved (or rebuilt) for whatever was committed
+    even if a later paper fails.
+    All results share one embedder, one index load and one index save. The
+    whole read-modify-write runs under ``INDEX_LOCK``, so concurrent ingests
+    (workers, cron) are serialized instead of overwriting each other's index.
+    Returns ``{"added": [...], "updated": [...], "skipped": [...]}`` of short ids.
+    """
+    results = list(results)
+    with filelock.locked(INDEX_LOCK):
+        summary = _ingest_locked(results)
+    print("Ingest summary:", {k: len(v) for k, v in summary.items()})
+    return summary
+
+def _ingest_locked(results):
+    from pypdf import PdfReader
+    wanted = {}
+    for r in results:
+        wanted.setdefault(r.get_short_id(), r)  # a paper may appear in several queries
+    stored = {}
+    bases = {split_arxiv_id(sid)[0] for sid in wanted}
+    for aid, ver in Document.objects.filter(arxiv_id__in=bases).values_list("arxiv_id", "version"):
+        stored[aid] = max(ver, stored.get(aid, 0))
+
+    summary = {"added": [], "updated": [], "skipped": []}
+    embed = None
+    idx, index_ids = None, None
+    replaced = False
+    committed = False
+    failed = True
+    try:
+        for short_id, r in wanted.items():
+            base, version = split_arxiv_id(short_id)
+            if stored.get(base, 0) >= version:
+                summary["skipped"].append(short_id)
+                continue
+            embed = embed or get_embedder()
+            if idx is None:
+                idx, index_ids = _load_current_index()
+                index_ids = list(index_ids)
+            pdf_path = f"data/pdfs/{short_id}.pdf"
+            if not os.path.exists(pdf_path):
+                r.download_pdf(filename=pdf_path)
+            # Extract plain text per page
+            reader = PdfReader(pdf_path)
+            text_pages = [(page.extract_text() or "") for page in reader.pages]
+            parts = chunk_text(text_pages)
+            vecs = None
+            if parts:
+                vecs = embed(parts)
+                # L2 normalize (cosine similarity with IndexFlatIP)
+                norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                vecs = vecs / norms
+                print("Embedding shape:", vecs.shape)
+            with transaction.atomic():
+                if base in stored:
+                    # new version: drop the old rows (chunks cascade); FAISS rows are rebuilt below
+                    Document.objects.filter(arxiv_id=base).delete()
+                doc = Document.objects.create(
+                    arxiv_id=base,
+                    version=version,
+                    title=r.title,
+                    authors=", ".join(a.name for a in r.authors),
+                    pdf_path=pdf_path,
+                )
+                if parts:
+                    # Persist chunk rows in one INSERT, then their vectors as one store segment
+                    rows = Chunk.objects.bulk_create([
+                        Chunk(doc=doc, kind="text", content=t, ord=i) for i, t in enumerate(parts)
+                    ])
+                    vectorstore.append([c.id for c in rows], vecs)
+            committed = True
+            if base in stored:
+                replaced = True
+                summary["updated"].append(short_id)
+            else:
+                summary["added"].append(short_id)
+            stored[base] = version
+            if parts:
+                # Add vectors to FAISS index
+                idx.add(vecs)
+                index_ids.extend(c.id for c in rows)
+        failed = False
+    finally:
+        if replaced or (failed and committed):
+            # deleted chunks shift FAISS row positions (and after an error the in-memory
+            # index may not match what was committed); regenerate from the vector store
+            rebuild_index()
+        elif committed:
+            save_index(idx, index_ids)
+            serving.publish_from_index(idx, index_ids)
+            if vectorstore.segment_count() > vectorstore.MAX_SEGMENTS:
+                vectorstore.compact()
+    return summary
+
 def ingest_arxiv(query="agentic RAG", max_results=1):
+    import arxiv
     search = arxiv.Search(query=query, max_results=max_results, sort_by=arxiv.SortCriterion.Relevance)
-    embed = get_embedder()
-    idx = load_or_new_index()
-
-    for r in search.results():
-        pdf_path = f"data/pdfs/{r.get_short_id()}.pdf"
-        if not os.path.exists(pdf_path):
-            r.download_pdf(filename=pdf_path)
-        doc = Document.objects.create(
-            arxiv_id=r.get_short_id(),
-            title=r.title,
-            authors=", ".join(a.name for a in r.authors),
-            pdf_path=pdf_path,
-        )
-        # Extract plain text per page
-        reader = PdfReader(pdf_path)
-        text_pages = [(page.extract_text() or "") for page in reader.pages]
-        parts = chunk_text(text_pages)
-        if not parts:
-            continue
-        vecs = embed(parts)
-        # L2 normalize (cosine similarity with IndexFlatIP)
-        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0
-        vecs = vecs / norms
-        print("Embedding shape:", vecs.shape)
-        # Persist each chunk
-        for i, (t, v) in enumerate(zip(parts, vecs)):
-            Chunk.objects.create(
-                doc=doc,
-                kind="text",
-                content=t,
-                ord=i,
-                vector=v.tobytes(),
-            )
-        # Add vectors to FAISS index
-        idx.add(vecs)
-    save_index(idx)
+    return ingest_results(search.results())
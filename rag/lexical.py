@@ -0,0 +1,76 @@
+"""Query-independent text preparation used by ``retrieval.answer``.
+
+Everything here depends only on a chunk's content, so it can be computed once
+per chunk and stored in the retrieval snapshot; ``answer()`` then only has to
+intersect the question's words with precomputed word sets.
+"""
+import re
+from typing import NamedTuple
+
+SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
+MIN_SENTENCE_CHARS = 20
+FIRST_SENTENCE_CHARS = 400
+
+
+def is_numeric_heavy(text: str) -> bool:
+    if not text:
+        return True
+    tokens = text.split()
+    if not tokens:
+        return True
+    digitish = sum(1 for t in tokens if sum(ch.isdigit() for ch in t) >= max(1, len(t)//2))
+    return digitish / max(1, len(tokens)) > 0.45  # skip tables/metrics
+
+
+def clean_sentence(s: str) -> str:
+    # remove excessive whitespace
+    return re.sub(r'\s+', ' ', s.strip())
+
+
+def words_of(text):
+    """Lowercased words with surrounding punctuation stripped (the unit of keyword overlap)."""
+    return {w.strip('.,();:') for w in text.lower().split()} - {""}
+
+
+def question_words(q):
+    return {w for w in q.lower().split() if len(w) > 2}
+
+
+class Sentence(NamedTuple):
+    text: str
+    words: frozenset
+    has_caps: bool   # keyword-like capitalized term near the start (fallback relevance)
+    tokens: int      # model tokens of ``text``
+
+
+class PreparedChunk(NamedTuple):
+    words: frozenset                 # chunk-level words (for ranking chunks)
+    first: str                       # first sentence, fallback snippet
+    sentences: tuple                 # non-numeric sentences longer than MIN_SENTENCE_CHARS
+
+
+def prepare(content, count_tokens):
+    """PreparedChunk for ``content``, or None if it has no usable prose.
+
+    Numeric-heavy chunks (tables/metrics) are reduced to their first
+    non-numeric '.'-separated part, or dropped if there is none.
+    """
+    txt = (content or "").strip()
+    if not txt:
+        return None
+    if is_numeric_heavy(txt):
+        # attempt to salvage first non-numeric sentence
+        txt = next((p for p in (p.strip() for p in txt.split('.')) if p and not is_numeric_heavy(p)), None)
+        if txt is None:
+            return None
+    sentences = []
+    for s in SENT_SPLIT.split(txt):
+        if len(s.strip()) <= MIN_SENTENCE_CHARS:
+            continue
+        snt = clean_sentence(s)
+        if is_numeric_heavy(snt):
+            continue
+        sentences.append(Sentence(snt, frozenset(words_of(snt)), any(ch.isupper() for ch in snt[:80]),
+                                  count_tokens(snt)))
+    first = SENT_SPLIT.split(txt)[0].strip()[:FIRST_SENTENCE_CHARS]
+    return PreparedChunk(frozenset(words_of(txt)), first, tuple(sentences))
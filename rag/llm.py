@@ -0,0 +1,228 @@
+"""Process-wide LLM gateway.
+
+One pooled OpenAI client per process (keep-alive HTTP connections via httpx)
+instead of a new client per request, plus:
+
+ - per-call deadlines (every request carries the remaining time as its timeout),
+ - a circuit breaker per model (after ``BREAKER_FAILURES`` consecutive failures the
+   model is skipped for ``BREAKER_RESET_S`` seconds, then one trial call is let through),
+ - hedged requests: if the primary has not answered after its observed p95
+   latency (``HEDGE_DELAY_S`` until enough samples exist), a backup request is
+   sent to the fallback model and whichever answers first wins.
+
+``OPENAI_BASE_URL`` points the gateway at another OpenAI-compatible server, e.g.
+the local stub from ``manage.py llmstub``.
+"""
+import os, time, random, threading, collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+API_KEY_PATH = "~/.openai_api_key_gpt5"
+BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+CHAT_MODEL = os.environ.get("OPENAI_CHAT_MODEL", "gpt-4o")
+FALLBACK_MODEL = os.environ.get("OPENAI_FALLBACK_MODEL", "gpt-4o-mini")
+DEADLINE_S = float(os.environ.get("ARXRAG_LLM_DEADLINE_S", "30"))
+HEDGE_DELAY_S = 2.0          # hedge delay until a model has MIN_SAMPLES latencies
+MIN_SAMPLES = 20
+BREAKER_FAILURES = 3
+BREAKER_RESET_S = 30.0
+MAX_CONNECTIONS = 32
+EMBED_RETRIES = 3            # extra attempts for transient embedding errors (429 / 5xx / connection)
+EMBED_BACKOFF_S = 0.5        # first backoff, doubled per attempt (with jitter)
+
+
+class LLMError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset_s=BREAKER_RESET_S):
+        self.failures, self.reset_s = failures, reset_s
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_s and not self.trial_in_flight:
+                self.trial_in_flight = True  # half-open: let one request probe the model
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.consecutive, self.opened_at, self.trial_in_flight = 0, None, False
+
+    def release(self):
+        """End a call that says nothing about the model's health (e.g. a rejected request)."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def failure(self):
+        with self.lock:
+            self.consecutive += 1
+            self.trial_in_flight = False
+            if self.consecutive >= self.failures:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return "closed" if self.opened_at is None else "open"
+
+
+class LatencyTracker:
+    def __init__(self, size=200):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(0.95 * len(s)))]
+
+
+_lock = threading.Lock()
+_client = None
+_pool = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS, thread_name_prefix="llm")
+_breakers = collections.defaultdict(CircuitBreaker)
+_latency = collections.defaultdict(LatencyTracker)
+
+
+def _api_key():
+    key = os.environ.get("OPENAI_API_KEY")
+    if key:
+        return key
+    with open(os.path.expanduser(API_KEY_PATH)) as f:
+        return f.read().strip()
+
+
+def get_client():
+    """The shared OpenAI client (created on first use, reused by every thread)."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+                http = httpx.Client(limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                                        max_keepalive_connections=MAX_CONNECTIONS // 2))
+                # retries are handled here (hedging / fallback for chat, backoff for embeddings),
+                # not inside the SDK
+                _client = OpenAI(api_key=_api_key(), base_url=BASE_URL, http_client=http,
+                                 timeout=DEADLINE_S, max_retries=0)
+    return _client
+
+
+def _call(model, messages, timeout, kwargs):
+    t0 = time.monotonic()
+    try:
+        out = get_client().chat.completions.create(model=model, messages=messages, timeout=timeout, **kwargs)
+    except Exception as e:
+        # only outages count toward opening the circuit; a 400 is the caller's fault
+        if _is_transient(e):
+            _breakers[model].failure()
+        else:
+            _breakers[model].release()
+        raise
+    _breakers[model].success()
+    _latency[model].add(time.monotonic() - t0)
+    return out
+
+
+def chat(messages, model=None, fallback=FALLBACK_MODEL, deadline_s=None, hedge=True, **kwargs):
+    """Chat completion with deadline, circuit breaking and hedging.
+
+    Returns ``(completion, info)`` where ``info`` records the model that answered,
+    whether a hedge was sent and how many requests were issued. Raises
+    ``LLMError`` if every model failed, all circuits are open, or the deadline passed.
+    """
+    model = model or CHAT_MODEL
+    deadline = time.monotonic() + (deadline_s or DEADLINE_S)
+    queue = [m for m in dict.fromkeys([model, fallback]) if m]
+    if len(queue) == 1 and hedge:
+        queue.append(queue[0])  # no fallback available: hedge against the same model
+
+    pending = {}
+    info = {"model": None, "hedged": False, "requests": 0}
+    last_error = None
+
+    def launch():
+        # breakers are consulted at launch time so a half-open trial is only claimed when used
+        while queue:
+            m = queue.pop(0)
+            if _breakers[m].allow():
+                remaining = max(0.05, deadline - time.monotonic())
+                pending[_pool.submit(_call, m, messages, remaining, kwargs)] = m
+                info["requests"] += 1
+                return True
+        return False
+
+    if not launch():
+        raise LLMError(f"circuit open for {model} and {fallback}")
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        primary = next(iter(pending.values()))
+        hedge_after = _latency[primary].p95() or HEDGE_DELAY_S
+        can_hedge = hedge and queue and not info["hedged"]
+        done, _ = wait(pending, timeout=min(remaining, hedge_after) if can_hedge else remaining,
+                       return_when=FIRST_COMPLETED)
+        if not done:
+            if can_hedge:
+                info["hedged"] = launch()
+            continue
+        for fut in done:
+            m = pending.pop(fut)
+            try:
+                out = fut.result()
+            except Exception as e:
+                last_error = e
+                continue
+            info["model"] = m
+            return out, info
+        if queue and not pending:
+            launch()  # everything in flight failed: fall back immediately
+    if last_error is not None and not pending:
+        raise LLMError(f"all models failed: {last_error}") from last_error
+    raise LLMError(f"LLM deadline of {deadline_s or DEADLINE_S:.1f}s exceeded")
+
+
+def _is_transient(e):
+    """Rate limits, server errors and connection failures are worth retrying; bad requests are not."""
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    try:
+        from openai import APIConnectionError
+    except ImportError:
+        APIConnectionError = ()
+    return isinstance(e, (APIConnectionError, ConnectionError, TimeoutError))
+
+
+def embeddings(model, texts, deadline_s=None):
+    """Embedding request through the pooled client.
+
+    Batches are large, so they are not hedged; transient errors are retried up
+    to ``EMBED_RETRIES`` times with exponential backoff, all within one deadline.
+    """
+    deadline = time.monotonic() + (deadline_s or DEADLINE_S)
+    for attempt in range(EMBED_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        try:
+            return get_client().embeddings.create(model=model, input=texts, timeout=max(0.05, remaining))
+        except Exception as e:
+            delay = EMBED_BACKOFF_S * 2 ** attempt * random.uniform(0.5, 1.0)
+            if attempt == EMBED_RETRIES or not _is_transient(e) or time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+
+
+def status():
+    """Breaker state and p95 per model, for diagnostics."""
+    return {m: {"state": b.state, "p95_s": _latency[m].p95()} for m, b in list(_breakers.items())}
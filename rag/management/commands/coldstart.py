@@ -0,0 +1,80 @@
+import json, os, subprocess, sys, time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported, mapped or cached.
+PROBE = r"""
+import json, os, sys, time
+t = {"start": time.time()}
+import django
+django.setup()
+t["django_setup"] = time.time()
+from rag import retrieval, serving, views
+t["imports"] = time.time()
+gen = serving.current()
+t["snapshot_attach"] = time.time()
+retrieval.warm()
+t["warm"] = time.time()
+question, answer = sys.argv[1], sys.argv[2] == "1"
+if answer:
+    retrieval.answer(question)
+    t["first_answer"] = time.time()
+    retrieval.answer(question)
+    t["second_answer"] = time.time()
+heavy = sorted(m for m in ("faiss", "torch", "transformers", "arxiv", "pypdf", "rapidfuzz") if m in sys.modules)
+print("COLDSTART " + json.dumps({"t": t, "generation": gen.gen if gen else None, "heavy_imports": heavy}))
+"""
+
+STAGES = ("django_setup", "imports", "snapshot_attach", "warm", "first_answer", "second_answer")
+
+
+class Command(BaseCommand):
+    help = ("Measure cold-start time to first answer: spawn fresh processes and time interpreter start, "
+            "django.setup, imports, snapshot attach, warm-up and the first (and second) answer. "
+            "Run against the llmstub backends to keep LLM latency out of the numbers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Fresh processes to start')
+        parser.add_argument('--question', type=str, default='What is retrieval-augmented generation?')
+        parser.add_argument('--no-answer', action='store_true', help='Stop after warm-up (no LLM/embedding calls)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **o):
+        env = dict(os.environ, ARXRAG_WARM_START="0")  # the probe warms explicitly so it can be timed
+        env.setdefault("DJANGO_SETTINGS_MODULE", "arxrag.settings")
+        runs = []
+        for _ in range(o['runs']):
+            spawned = time.time()
+            proc = subprocess.run([sys.executable, "-c", PROBE, o['question'], "0" if o['no_answer'] else "1"],
+                                  env=env, capture_output=True, text=True)
+            line = next((l for l in proc.stdout.splitlines() if l.startswith("COLDSTART ")), None)
+            if proc.returncode or line is None:
+                raise CommandError(f"probe failed:\n{proc.stderr[-2000:]}")
+            data = json.loads(line[len("COLDSTART "):])
+            t = data["t"]
+            stages, prev = {"interpreter": t["start"] - spawned}, t["start"]
+            for name in STAGES:
+                if name in t:
+                    stages[name] = t[name] - prev
+                    prev = t[name]
+            stages["to_first_answer" if "first_answer" in t else "to_ready"] = \
+                t.get("first_answer", t["warm"]) - spawned
+            runs.append({"stages": stages, "generation": data["generation"], "heavy_imports": data["heavy_imports"]})
+
+        names = list(runs[0]["stages"])
+        report = {
+            "runs": len(runs),
+            "generation": runs[-1]["generation"],
+            "heavy_imports": runs[-1]["heavy_imports"],
+            "stages_s": {n: {"median": round(float(np.median([r["stages"][n] for r in runs])), 4),
+                             "max": round(max(r["stages"][n] for r in runs), 4)} for n in names},
+        }
+        if o['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        gen = report["generation"]
+        self.stdout.write(f"{report['runs']} cold starts, snapshot generation {gen if gen else 'none'}, "
+                          f"heavy imports: {', '.join(report['heavy_imports']) or 'none'}")
+        for n, st in report["stages_s"].items():
+            line = f"  {n:<16} median={st['median']:.4f}s max={st['max']:.4f}s"
+            self.stdout.write(self.style.SUCCESS(line) if n.startswith("to_") else line)
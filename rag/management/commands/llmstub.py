@@ -0,0 +1,87 @@
+import hashlib, json, random, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from django.core.management.base import BaseCommand
+from rag.ingest import DIM
+
+
+class Command(BaseCommand):
+    help = ("Run a local OpenAI-compatible stub (/v1/embeddings, /v1/chat/completions) for tests and load runs. "
+            "Point the app at it with OPENAI_BASE_URL=http://HOST:PORT/v1 OPENAI_API_KEY=stub.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--dim', type=int, default=DIM, help='Embedding dimension')
+        parser.add_argument('--chat-latency-ms', type=float, default=300.0, help='Median chat latency')
+        parser.add_argument('--embed-latency-ms', type=float, default=20.0, help='Median embedding latency')
+        parser.add_argument('--tail-rate', type=float, default=0.05, help='Fraction of chat calls that are 10x slower')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of chat calls answered with HTTP 500')
+        parser.add_argument('--fail-model', type=str, default='', help='Only fail/slow down this model (default: all)')
+
+    def handle(self, *args, **o):
+        dim = o['dim']
+
+        def embed(text):
+            # deterministic per text so repeated runs hit the same neighbours
+            seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+            v = np.random.default_rng(seed).standard_normal(dim).astype('float32')
+            return (v / np.linalg.norm(v)).tolist()
+
+        def jitter(median_ms):
+            return max(0.0, random.gauss(median_ms, median_ms * 0.2)) / 1000.0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.endswith('/embeddings'):
+                    texts = req.get('input') or []
+                    texts = [texts] if isinstance(texts, str) else texts
+                    time.sleep(jitter(o['embed_latency_ms']))
+                    data = [{'object': 'embedding', 'index': i, 'embedding': embed(t)} for i, t in enumerate(texts)]
+                    n = sum(len(t.split()) for t in texts)
+                    return self._send(200, {'object': 'list', 'data': data, 'model': req.get('model'),
+                                            'usage': {'prompt_tokens': n, 'total_tokens': n}})
+                if self.path.endswith('/chat/completions'):
+                    model = req.get('model', '')
+                    targeted = not o['fail_model'] or model == o['fail_model']
+                    delay = jitter(o['chat_latency_ms'])
+                    if targeted and random.random() < o['tail_rate']:
+                        delay *= 10
+                    time.sleep(delay)
+                    if targeted and random.random() < o['fail_rate']:
+                        return self._send(500, {'error': {'message': 'stub failure', 'type': 'server_error'}})
+                    prompt = ' '.join(m.get('content', '') for m in req.get('messages', []))
+                    completion = min(int(req.get('max_tokens') or 200), 120)
+                    text = 'Stub answer grounded in the provided snippets [0]. ' * (completion // 10)
+                    p = len(prompt.split())
+                    return self._send(200, {
+                        'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': text.strip()}}],
+                        'usage': {'prompt_tokens': p, 'completion_tokens': completion, 'total_tokens': p + completion},
+                    })
+                self._send(404, {'error': {'message': f'unknown path {self.path}'}})
+
+        server = ThreadingHTTPServer((o['host'], o['port']), Handler)
+        self.stdout.write(self.style.SUCCESS(
+            f"LLM stub on http://{o['host']}:{o['port']}/v1 (dim={dim}); export OPENAI_BASE_URL=http://{o['host']}:{o['port']}/v1 OPENAI_API_KEY=stub"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,169 @@
+import json, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+
+def load_records(path):
+    """Request log lines -> (path, body) pairs.
+
+    Recorded lines look like ``{"path": "/api/ask", "body": {...}}`` and are sent
+    as-is. Any other JSON line is treated as synthetic input: its ``question``,
+    ``title``, ``query`` or ``body`` text becomes an ``/api/ask`` question.
+    """
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if "path" in rec:
+                records.append((rec["path"], rec.get("body") or {}))
+                continue
+            text = next((rec[k] for k in ("question", "title", "query", "body") if rec.get(k)), None)
+            if text:
+                records.append(("/api/ask", {"question": str(text)[:300], "k": 5}))
+    return records
+
+
+def pct(values, q):
+    return float(np.percentile(values, q)) if len(values) else float("nan")
+
+
+class Command(BaseCommand):
+    help = ("Replay a JSONL request log against a running server (start it with the llmstub backends) "
+            "and report throughput, p50/p95/p99 latency, error rates and per-stage timings from meta.timings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='Server base URL')
+        parser.add_argument('--file', type=str, default='requests.jsonl', help='JSONL request log to replay')
+        parser.add_argument('--concurrency', type=int, default=8, help='Closed loop: parallel clients (ignored with --rate)')
+        parser.add_argument('--rate', type=float, default=0.0, help='Open loop: target requests/second')
+        parser.add_argument('--requests', type=int, default=200, help='Total requests to send')
+        parser.add_argument('--duration', type=float, default=0.0, help='Stop after this many seconds (overrides --requests)')
+        parser.add_argument('--ingest-ratio', type=float, default=0.0,
+                            help='Fraction of requests turned into /api/agent/search_ingest calls')
+        parser.add_argument('--lean', action='store_true', help='Send "lean": true on ask requests')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout (s)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **o):
+        records = load_records(o['file'])
+        if not records:
+            raise CommandError(f"no usable requests in {o['file']}")
+        rng = random.Random(o['seed'])
+        base = o['url'].rstrip('/')
+        local = threading.local()
+        results = []
+        results_lock = threading.Lock()
+
+        def next_request(i):
+            path, body = records[i % len(records)]
+            body = dict(body)
+            if path == '/api/ask' and rng.random() < o['ingest_ratio']:
+                path, body = '/api/agent/search_ingest', {'query': body.get('question', ''), 'max_results': 1}
+            elif path.endswith('/ask') and o['lean']:
+                body['lean'] = True
+            return path, body
+
+        def send(path, body, scheduled):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            status, timings, error = 0, {}, None
+            try:
+                r = session.post(base + path, json=body, timeout=o['timeout'])
+                status = r.status_code
+                if r.ok:
+                    timings = (r.json().get('meta') or {}).get('timings') or {}
+                else:
+                    error = f"HTTP {status}"
+            except requests.RequestException as e:
+                error = type(e).__name__
+            # measured from the scheduled start so server stalls are not hidden (no coordinated omission)
+            latency = time.perf_counter() - scheduled
+            with results_lock:
+                results.append({'path': path, 'latency': latency, 'status': status, 'error': error, 'timings': timings})
+
+        t0 = time.perf_counter()
+        deadline = t0 + o['duration'] if o['duration'] else None
+        total = None if deadline else o['requests']
+        if o['rate'] > 0:
+            # open loop: requests are issued on a fixed schedule regardless of completions
+            with ThreadPoolExecutor(max_workers=max(o['concurrency'], int(o['rate'] * 4), 8)) as pool:
+                i = 0
+                while (total is None or i < total):
+                    scheduled = t0 + i / o['rate']
+                    if deadline and scheduled > deadline:
+                        break
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(send, *next_request(i), scheduled)
+                    i += 1
+        else:
+            counter = iter(range(10 ** 12))
+            counter_lock = threading.Lock()
+
+            def worker():
+                while True:
+                    with counter_lock:
+                        i = next(counter)
+                        path, body = next_request(i)
+                    if (total is not None and i >= total) or (deadline and time.perf_counter() > deadline):
+                        return
+                    send(path, body, time.perf_counter())
+
+            threads = [threading.Thread(target=worker, daemon=True) for _ in range(o['concurrency'])]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        wall = time.perf_counter() - t0
+
+        report = self.summarize(results, wall, o)
+        if o['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def summarize(self, results, wall, o):
+        mode = f"open loop @ {o['rate']}/s" if o['rate'] > 0 else f"closed loop x{o['concurrency']}"
+        report = {'mode': mode, 'wall_s': round(wall, 3), 'endpoints': {}}
+        for path in sorted({r['path'] for r in results}):
+            rows = [r for r in results if r['path'] == path]
+            ok = [r for r in rows if r['error'] is None]
+            lat = [r['latency'] for r in ok]
+            stages = {}
+            for r in ok:
+                for name, v in r['timings'].items():
+                    if isinstance(v, (int, float)):
+                        stages.setdefault(name, []).append(v)
+            errors = {}
+            for r in rows:
+                if r['error']:
+                    errors[r['error']] = errors.get(r['error'], 0) + 1
+            report['endpoints'][path] = {
+                'requests': len(rows),
+                'throughput_rps': round(len(ok) / wall, 2) if wall else 0.0,
+                'error_rate': round(1 - len(ok) / len(rows), 4) if rows else 0.0,
+                'errors': errors,
+                'latency_s': {'p50': round(pct(lat, 50), 4), 'p95': round(pct(lat, 95), 4),
+                              'p99': round(pct(lat, 99), 4), 'max': round(max(lat), 4) if lat else None},
+                'stages_s': {name: {'mean': round(float(np.mean(v)), 4), 'p95': round(pct(v, 95), 4)}
+                             for name, v in stages.items()},
+            }
+        return report
+
+    def print_report(self, report):
+        self.stdout.write(f"{report['mode']}, wall {report['wall_s']}s")
+        for path, ep in report['endpoints'].items():
+            lat = ep['latency_s']
+            self.stdout.write(self.style.SUCCESS(path))
+            self.stdout.write(f"  requests={ep['requests']} throughput={ep['throughput_rps']}/s error_rate={ep['error_rate']:.2%} {ep['errors'] or ''}")
+            self.stdout.write(f"  latency p50={lat['p50']:.3f}s p95={lat['p95']:.3f}s p99={lat['p99']:.3f}s max={lat['max']}")
+            for name, st in ep['stages_s'].items():
+                self.stdout.write(f"    {name:<10} mean={st['mean']:.4f}s p95={st['p95']:.4f}s")
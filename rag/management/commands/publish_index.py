@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from rag import filelock, serving
+from rag.ingest import load_index, INDEX_LOCK
+
+
+class Command(BaseCommand):
+    help = ("Publish the current FAISS index, chunk metadata and precomputed sentence data "
+            "as a new retrieval snapshot generation.")
+
+    def handle(self, *args, **options):
+        # an ingest publishing at the same time must not be overtaken by this older index
+        with filelock.locked(INDEX_LOCK):
+            idx, chunk_ids = load_index()
+            gen = serving.publish_from_index(idx, chunk_ids)
+        self.stdout.write(self.style.SUCCESS(f"Published generation {gen} ({idx.ntotal} vectors) to {serving.SERVING_DIR}"))
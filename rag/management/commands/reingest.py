@@ -1,7 +1,8 @@
-import os
+import os, shutil
 from django.core.management.base import BaseCommand
 from rag.models import Chunk, Document
-from rag.ingest import ingest_arxiv, INDEX_PATH
+from rag.ingest import ingest_arxiv, rebuild_index, INDEX_LOCK, INDEX_PATH
+from rag import filelock, vectorstore
 
 class Command(BaseCommand):
     help = "Rebuild FAISS index with normalized embeddings by clearing existing chunks/documents and reingesting arXiv papers."
@@ -12,6 +13,11 @@ class Command(BaseCommand):
         parser.add_argument('--keep-docs', action='store_true', help='Keep existing Document rows (only rebuild index from stored vectors)')
 
     def handle(self, *args, **options):
+        # no ingest may run between clearing and re-ingesting
+        with filelock.locked(INDEX_LOCK):
+            self._reingest(options)
+
+    def _reingest(self, options):
         query = options['query']
         max_results = options['max_results']
         keep_docs = options['keep_docs']
@@ -26,11 +32,16 @@ class Command(BaseCommand):
         if not keep_docs:
             Chunk.objects.all().delete()
             Document.objects.all().delete()
-            self.stdout.write(self.style.WARNING("Cleared Chunk and Document tables."))
+            shutil.rmtree(vectorstore.STORE_DIR, ignore_errors=True)
+            # the retrieval snapshot is kept: workers serve it until ingestion below
+            # publishes the next generation (which never reuses a generation number)
+            self.stdout.write(self.style.WARNING("Cleared Chunk and Document tables and the vector store."))
         else:
-            # If keeping docs, just rebuild from scratch by reingesting (will duplicate unless we skip already existing arxiv_ids)
+            # Keep docs: rebuild the index from stored vectors so existing chunks stay searchable
             existing_ids = set(Document.objects.values_list('arxiv_id', flat=True))
-            self.stdout.write(f"Keeping {len(existing_ids)} existing documents; new ingestion will add more if different.")
+            idx = rebuild_index()
+            self.stdout.write(f"Keeping {len(existing_ids)} existing documents; rebuilt index with {idx.ntotal} stored vectors.")
 
-        ingest_arxiv(query=query, max_results=max_results)
-        self.stdout.write(self.style.SUCCESS("Reingestion complete."))
+        summary = ingest_arxiv(query=query, max_results=max_results)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reingestion complete: {len(summary['added'])} added, {len(summary['updated'])} updated, {len(summary['skipped'])} unchanged."))
@@ -0,0 +1,39 @@
+import arxiv
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rag.models import SavedQuery
+from rag.ingest import ingest_results
+
+
+class Command(BaseCommand):
+    help = "Pull the newest arXiv results for every saved query and ingest only new papers / new versions (cron-friendly)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--add', type=str, help='Save this query (then sync)')
+        parser.add_argument('--max-results', type=int, default=10, help='Max results per query when saving with --add')
+        parser.add_argument('--remove', type=str, help='Delete a saved query and exit')
+
+    def handle(self, *args, **options):
+        if options['remove']:
+            n, _ = SavedQuery.objects.filter(query=options['remove']).delete()
+            self.stdout.write(f"Removed {n} saved query.")
+            return
+        if options['add']:
+            SavedQuery.objects.update_or_create(query=options['add'], defaults={'max_results': options['max_results']})
+
+        queries = list(SavedQuery.objects.all())
+        if not queries:
+            self.stdout.write("No saved queries; add one with --add.")
+            return
+        client = arxiv.Client()
+        results = []
+        for sq in queries:
+            search = arxiv.Search(query=sq.query, max_results=sq.max_results, sort_by=arxiv.SortCriterion.SubmittedDate)
+            found = list(client.results(search))
+            results.extend(found)
+            self.stdout.write(f"{sq.query!r}: {len(found)} results")
+        # one ingest pass for all queries: single embedder / index load / index save
+        summary = ingest_results(results)
+        SavedQuery.objects.filter(pk__in=[sq.pk for sq in queries]).update(last_synced_at=timezone.now())
+        self.stdout.write(self.style.SUCCESS(
+            f"Sync complete: {len(summary['added'])} added, {len(summary['updated'])} updated, {len(summary['skipped'])} unchanged."))
@@ -0,0 +1,57 @@
+import numpy as np
+from django.db import migrations
+
+BATCH = 2000
+
+
+def move_vectors_to_store(apps, schema_editor):
+    from rag import vectorstore
+    Chunk = apps.get_model("rag", "Chunk")
+    ids, vecs = [], []
+
+    def flush():
+        # one segment per vector dimension (text vs. image embeddings)
+        by_dim = {}
+        for cid, v in zip(ids, vecs):
+            by_dim.setdefault(v.shape[0], ([], []))
+            by_dim[v.shape[0]][0].append(cid)
+            by_dim[v.shape[0]][1].append(v)
+        for d_ids, d_vecs in by_dim.values():
+            vectorstore.append(d_ids, np.stack(d_vecs))
+        ids.clear(); vecs.clear()
+
+    for cid, blob in Chunk.objects.order_by("id").values_list("id", "vector").iterator(chunk_size=BATCH):
+        if not blob:
+            continue
+        ids.append(cid)
+        vecs.append(np.frombuffer(bytes(blob), dtype="float32"))
+        if len(ids) >= BATCH:
+            flush()
+    if ids:
+        flush()
+
+
+def restore_vectors(apps, schema_editor):
+    from rag import vectorstore
+    Chunk = apps.get_model("rag", "Chunk")
+    store = vectorstore.VectorStore(vectorstore.STORE_DIR)
+    for c in Chunk.objects.order_by("id").iterator(chunk_size=BATCH):
+        if c.id in store:
+            c.vector = store.get([c.id])[0].tobytes()
+            c.save(update_fields=["vector"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0001_initial'),
+    ]
+
+    operations = [
+        # RemoveField is reversed first on rollback, so restore_vectors sees the column again
+        migrations.RunPython(move_vectors_to_store, restore_vectors),
+        migrations.RemoveField(
+            model_name='chunk',
+            name='vector',
+        ),
+    ]
@@ -0,0 +1,57 @@
+import re
+from django.db import migrations, models
+
+_VERSION_RE = re.compile(r"^(.*)v(\d+)$")
+
+
+def split_versions(apps, schema_editor):
+    Document = apps.get_model("rag", "Document")
+    for doc in Document.objects.all():
+        m = _VERSION_RE.match(doc.arxiv_id or "")
+        if m:
+            doc.arxiv_id, doc.version = m.group(1), int(m.group(2))
+            doc.save(update_fields=["arxiv_id", "version"])
+    # ingestion used to add every version (and re-runs of the same one) as a new
+    # row; keep one Document per paper: the highest version, newest row first.
+    # Chunks of the others cascade; their FAISS rows go with `reingest --keep-docs`.
+    seen, stale = set(), []
+    for pk, aid in Document.objects.exclude(arxiv_id="").order_by(
+            "arxiv_id", "-version", "-added_at", "-id").values_list("id", "arxiv_id"):
+        if aid in seen:
+            stale.append(pk)
+        seen.add(aid)
+    if stale:
+        Document.objects.filter(pk__in=stale).delete()
+
+
+def join_versions(apps, schema_editor):
+    Document = apps.get_model("rag", "Document")
+    for doc in Document.objects.exclude(arxiv_id=""):
+        doc.arxiv_id = f"{doc.arxiv_id}v{doc.version}"
+        doc.save(update_fields=["arxiv_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0002_move_vectors_to_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='version',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.RunPython(split_versions, join_versions),
+        migrations.CreateModel(
+            name='SavedQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.TextField(unique=True)),
+                ('max_results', models.IntegerField(default=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
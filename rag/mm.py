@@ -1,13 +1,19 @@
-import fitz, numpy as np, os
-from PIL import Image
-import torch
-from transformers import CLIPProcessor, CLIPModel
+import numpy as np, os
+from functools import lru_cache
 from .models import Document, Chunk
+from . import vectorstore
 
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-proc  = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+@lru_cache(maxsize=None)
+def get_clip():
+    """(model, processor), loaded on first use: torch/transformers import takes seconds."""
+    from transformers import CLIPProcessor, CLIPModel
+    return (CLIPModel.from_pretrained("openai/clip-vit-base-patch32"),
+            CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32"))
 
 def extract_images(pdf_path, out_dir="data/images", doc=None, start_ord=100000):
+    import fitz, torch
+    from PIL import Image
+    model, proc = get_clip()
     os.makedirs(out_dir, exist_ok=True)
     images = []
     with fitz.open(pdf_path) as docpdf:
@@ -24,6 +30,9 @@ def extract_images(pdf_path, out_dir="data/images", doc=None, start_ord=100000):
     with torch.no_grad():
         ivec = model.get_image_features(**tensors)
     ivec = (ivec / ivec.norm(dim=-1, keepdim=True)).cpu().numpy().astype("float32")
-    for i,(p,v) in enumerate(zip(images, ivec)):
-        Chunk.objects.create(doc=doc, kind="image", image_path=p, content="", ord=start_ord+i, vector=v.tobytes())
+    rows = Chunk.objects.bulk_create([
+        Chunk(doc=doc, kind="image", image_path=p, content="", ord=start_ord+i) for i, p in enumerate(images)
+    ])
+    if rows:
+        vectorstore.append([c.id for c in rows], ivec)
     return len(images)
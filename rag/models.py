@@ -2,7 +2,8 @@
 from django.db import models
 
 class Document(models.Model):
-    arxiv_id = models.CharField(max_length=32, blank=True, db_index=True)
+    arxiv_id = models.CharField(max_length=32, blank=True, db_index=True)  # without version suffix
+    version = models.IntegerField(default=1)                               # arXiv "vN"
     title = models.TextField()
     authors = models.TextField(blank=True)
     pdf_path = models.TextField()          # local cache path
@@ -13,9 +14,16 @@ class Chunk(models.Model):
     kind = models.CharField(max_length=8, default="text")  # "text" | "image"
     content = models.TextField(blank=True)                 # text or caption
     image_path = models.TextField(blank=True)              # if kind="image"
-    vector = models.BinaryField()                          # np.float32 bytes
+    # embedding lives in rag.vectorstore (columnar .npy segments keyed by chunk id)
     ord = models.IntegerField(default=0)
 
+class SavedQuery(models.Model):
+    """An arXiv query re-run by ``manage.py sync_arxiv``."""
+    query = models.TextField(unique=True)
+    max_results = models.IntegerField(default=10)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
 class QueryLog(models.Model):
     query = models.TextField()
     topk = models.IntegerField(default=5)
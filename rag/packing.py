@@ -0,0 +1,118 @@
+"""Token-budgeted context packing.
+
+Counts real model tokens (tiktoken) instead of whitespace words and picks the
+snippet sentences for a prompt as a 0/1 knapsack: maximize total relevance
+score subject to a token budget, so a few long low-value sentences cannot
+crowd out several short relevant ones. Without tiktoken (or its encoding
+files), counts fall back to a ~4 characters/token estimate.
+"""
+import numpy as np
+
+FALLBACK_ENCODING = "o200k_base"   # gpt-4o family
+_encoders = {}
+_load_failed = False
+
+
+def get_encoder(model=None):
+    """Cached tiktoken encoding for ``model``; None if tiktoken is unavailable.
+
+    tiktoken downloads its BPE files on first use; if that fails (no network,
+    no cache) the estimate is used too, and the failure is reported once.
+    """
+    global _load_failed
+    key = model or ""
+    if key not in _encoders:
+        try:
+            _encoders[key] = _load_encoder(model)
+        except ImportError:
+            _encoders[key] = None
+        except Exception as e:
+            _encoders[key] = None
+            if not _load_failed:
+                _load_failed = True
+                print("tiktoken unavailable, estimating tokens as chars/4:", e)
+    return _encoders[key]
+
+
+def _load_encoder(model):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(FALLBACK_ENCODING)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    enc = get_encoder(model)
+    if enc is None:
+        return max(1, len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model=None):
+    """Prompt tokens of a chat request (3 framing tokens per message + 3 for the reply primer)."""
+    return 3 + sum(3 + count_tokens(m["content"], model) for m in messages)
+
+
+def knapsack(values, weights, budget):
+    """Indices maximizing ``sum(values)`` with ``sum(weights) <= budget`` (0/1 knapsack).
+
+    Dynamic program over capacities with one vectorized row update per item:
+    O(n * budget) time, an (n, budget+1) bool table for backtracking.
+    """
+    n, budget = len(values), int(budget)
+    if n == 0 or budget <= 0:
+        return []
+    best = np.zeros(budget + 1)
+    take = np.zeros((n, budget + 1), dtype=bool)
+    for i, (v, w) in enumerate(zip(values, weights)):
+        w = int(w)
+        if w > budget:
+            continue
+        with_item = best[: budget + 1 - w] + v
+        better = with_item > best[w:]
+        take[i, w:] = better
+        best[w:] = np.where(better, with_item, best[w:])
+    chosen, c = [], budget
+    for i in range(n - 1, -1, -1):
+        if take[i, c]:
+            chosen.append(i)
+            c -= int(weights[i])
+    return chosen[::-1]
+
+
+def pack_sentences(records, budget, per_chunk_cap=3, model=None, token_counts=None):
+    """Choose ``(score, chunk_index, sentence)`` records to fit ``budget`` tokens.
+
+    Each chunk contributes at most ``per_chunk_cap`` sentences (its highest
+    scoring, shorter first on ties) to the knapsack. Returns ``(selected, stats)``
+    where ``selected`` keeps the input order and ``stats`` holds
+    ``snippet_tokens`` (selected) and ``candidate_tokens`` (all records, i.e. the
+    cost without packing). ``token_counts`` may supply precomputed sentence
+    token counts (aligned with ``records``); the "[i] " prefix is added on top.
+    """
+    if token_counts is None:
+        costed = [(rec, count_tokens(f"[{rec[1]}] {rec[2]}\n", model)) for rec in records]
+    else:
+        prefix = {}
+        for rec in records:
+            if rec[1] not in prefix:
+                prefix[rec[1]] = count_tokens(f"[{rec[1]}] \n", model)
+        costed = [(rec, t + prefix[rec[1]]) for rec, t in zip(records, token_counts)]
+    by_chunk = {}
+    for pos, (rec, t) in enumerate(costed):
+        by_chunk.setdefault(rec[1], []).append((pos, rec[0], t))
+    pool = []
+    for items in by_chunk.values():
+        items.sort(key=lambda x: (-x[1], x[2]))
+        pool.extend(items[:per_chunk_cap])
+    chosen = knapsack([p[1] for p in pool], [p[2] for p in pool], budget)
+    keep = sorted(pool[j][0] for j in chosen)
+    selected = [costed[p][0] for p in keep]
+    stats = {
+        "snippet_tokens": sum(costed[p][1] for p in keep),
+        "candidate_tokens": sum(t for _, t in costed),
+    }
+    return selected, stats
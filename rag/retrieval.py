@@ -1,132 +1,257 @@
-import numpy as np, faiss, os, time
+import numpy as np, os, time, hashlib, threading
 from .models import Chunk
-from .ingest import get_embedder, INDEX_PATH, DIM
+from . import chunkmeta, lexical, llm, packing, serving
+from .ingest import get_embedder, load_index, INDEX_PATH, DIM
 
-def search(q, k=5, multimodal=True):
+FETCH_MULTIPLIER = 4    # over-fetch k * FETCH_MULTIPLIER candidates before diversification
+MMR_LAMBDA = 0.5        # 1.0 = pure relevance, 0.0 = pure diversity
+TOKEN_BUDGET = int(os.environ.get("ARXRAG_TOKEN_BUDGET", "1500"))  # prompt + answer tokens per LLM call
+MIN_ANSWER_TOKENS = 220
+MAX_ANSWER_TOKENS = 400
+PER_CHUNK_SENTENCES = 3
+
+SYSTEM_PROMPT = ("You are a scholarly assistant. Use the provided Sources metadata and Snippets (curated sentences) "
+                 "to answer accurately. Cite supporting source indices like [2] or [1,3]. Do NOT output large tables "
+                 "or full paragraphs; only synthesized prose. If a detail is not in snippets, state uncertainty. "
+                 "Keep answer focused; extra fluff discouraged.")
+
+
+def mmr_select(qv, vecs, k, lambda_mult=MMR_LAMBDA, groups=None, per_group_cap=None):
+    """Maximal-marginal-relevance selection over candidate vectors.
+
+    ``qv`` is a (d,) normalized query vector and ``vecs`` an (n, d) matrix of
+    normalized candidate vectors. Returns up to ``k`` row indices into ``vecs``,
+    in selection order. When ``groups`` (length-n labels, e.g. doc ids) and
+    ``per_group_cap`` are given, at most ``per_group_cap`` rows per label are picked.
+    Each step is one matrix-vector product, so the whole pass is O(n*k*d).
+    """
+    n = vecs.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    rel = vecs @ qv
+    max_sim = np.full(n, -np.inf, dtype="float32")  # similarity to closest selected row
+    available = np.ones(n, dtype=bool)
+    group_counts = {}
+    selected = []
+    while len(selected) < k and available.any():
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        score = lambda_mult * rel - (1.0 - lambda_mult) * redundancy
+        score[~available] = -np.inf
+        j = int(np.argmax(score))
+        available[j] = False
+        if per_group_cap is not None and groups is not None:
+            g = groups[j]
+            if group_counts.get(g, 0) >= per_group_cap:
+                continue
+            group_counts[g] = group_counts.get(g, 0) + 1
+        selected.append(j)
+        np.maximum(max_sim, vecs @ vecs[j], out=max_sim)
+    return selected
+
+
+def _embed_query(q):
     embed = get_embedder()
     qv = embed([q]).astype("float32")
     # Normalize query vector to match normalized index vectors (cosine similarity via inner product)
     q_norm = np.linalg.norm(qv, axis=1, keepdims=True)
     q_norm[q_norm == 0] = 1.0
-    qv = qv / q_norm
-    idx = faiss.read_index(INDEX_PATH)
-    D, I = idx.search(qv, k)
-    chunks = Chunk.objects.all().order_by("id")
-    hits = []
-    seen = set()
-    for row in I[0]:
-        idx_py = int(row)  # Convert numpy.int64 to Python int
-        if 0 <= idx_py < chunks.count():
-            if idx_py in seen:
-                continue
-            seen.add(idx_py)
-            ch = chunks[idx_py]
-            hits.append(ch)
+    return qv / q_norm
+
+
+_faiss_lock = threading.Lock()
+_faiss_state = None   # (index, table)
+_faiss_mtime = None
+
+
+def _read_faiss_index():
+    """``(index, table)`` for the FAISS index at ``INDEX_PATH``.
+
+    Cached per process until the index file changes; the metadata table is
+    rebuilt on the same key from the chunk ids saved with the index, so the
+    row -> chunk mapping always matches the index that was loaded.
+    """
+    global _faiss_state, _faiss_mtime
+    mtime = os.stat(INDEX_PATH).st_mtime_ns
+    if _faiss_state is not None and mtime == _faiss_mtime:
+        return _faiss_state
+    with _faiss_lock:
+        if _faiss_state is None or mtime != _faiss_mtime:
+            idx, chunk_ids = load_index()
+            _faiss_state, _faiss_mtime = (idx, chunkmeta.ChunkMetaTable.build(chunk_ids)), mtime
+        return _faiss_state
+
+
+def _open_index():
+    """Return ``(index, metadata table)`` for the configured serving mode.
+
+    In shared mode this is the memory-mapped current generation (falling back to
+    the FAISS file until one has been published); otherwise the FAISS index is
+    read from ``INDEX_PATH``.
+    """
+    if serving.SERVING_MODE == "shared":
+        gen = serving.current()
+        if gen is not None and gen.index is not None:
+            return gen.index, gen.table
+    return _read_faiss_index()
+
+
+def warm():
+    """Load retrieval state ahead of the first request (see ``RagConfig.ready``)."""
+    t0 = time.time()
+    gen = serving.current()
+    if (serving.SERVING_MODE != "shared" or gen is None or gen.index is None) and os.path.exists(INDEX_PATH):
+        _read_faiss_index()
+    if gen is not None:
+        # fault in the small columns now; vectors are paged in by the first scans
+        for name in ("has_text", "chunk_sent_offsets", "sent_caps", "sent_tokens"):
+            gen.snap[name].sum()
+    print(f"retrieval: warm in {1000 * (time.time() - t0):.1f} ms")
+
+
+def _prepared_chunks(ctxs):
+    """``lexical.PreparedChunk`` (or None) per context, from the snapshot where it covers them."""
+    gen = serving.current()
+    cached = gen.prepared([c.id for c in ctxs]) if gen is not None and gen.token_model == llm.CHAT_MODEL else {}
+    count = lambda t: packing.count_tokens(t, model=llm.CHAT_MODEL)
+    return [cached[c.id] if c.id in cached else lexical.prepare(c.content, count) for c in ctxs]
+
+
+def _id_selector(mask):
+    """FAISS bitmap selector admitting the rows set in ``mask``.
+
+    Returns ``(selector, bits)``; the caller must keep ``bits`` alive while the
+    selector is in use since FAISS only holds a raw pointer to it.
+    """
+    import faiss
+    bits = np.packbits(mask, bitorder="little")
+    return faiss.IDSelectorBitmap(bits.size, faiss.swig_ptr(bits)), bits
+
+
+def search(q, k=5, multimodal=True, fetch_k=None, lambda_mult=MMR_LAMBDA,
+           per_doc_cap=None, kinds=("text",), arxiv_ids=None, added_after=None,
+           authors=None, stats=None):
+    """Return exactly ``k`` diverse hits (fewer only if the filtered corpus runs out).
+
+    Metadata filters (``kinds``, ``arxiv_ids``, ``added_after``, ``authors``) are
+    turned into a row mask over the chunk metadata table and applied inside the
+    FAISS scan via an ID selector. The search over-fetches ``fetch_k`` candidates,
+    collapses exact-duplicate contents, then runs MMR over the stored vectors with
+    an optional per-document cap. If that leaves fewer than ``k`` hits the fetch
+    window is doubled until the eligible rows are exhausted.
+    Pass a dict as ``stats`` to receive candidate/dedup counts (``fetched`` FAISS
+    labels, ``original`` distinct chunks before content dedup, ``after_dedup``).
+    """
+    t_start = time.time()
+    qv = _embed_query(q)
+    t_embedded = time.time()
+    idx, table = _open_index()
+    shared = isinstance(idx, serving.MappedIndex)
+    if idx.ntotal != len(table):
+        raise RuntimeError(f"index has {idx.ntotal} rows but its metadata table {len(table)}")
+    ntotal = idx.ntotal
+    mask = np.zeros(idx.ntotal, dtype=bool)
+    mask[:ntotal] = table.mask(arxiv_ids=arxiv_ids, kinds=kinds, added_after=added_after, authors=authors)[:ntotal]
+    n_eligible = int(mask.sum())
+    params, bits = None, None
+    if n_eligible < idx.ntotal and not shared:
+        import faiss
+        sel, bits = _id_selector(mask)
+        params = faiss.SearchParameters(sel=sel)
+    fetch_k = min(fetch_k or k * FETCH_MULTIPLIER, n_eligible)
+    labels, candidates, hits = [], [], []
+    n_resolved = 0
+    while fetch_k > 0:
+        if shared:
+            D, I = idx.search(qv, fetch_k, mask=mask)
         else:
-            # Optionally log or skip out-of-bounds index
-            pass
+            D, I = idx.search(qv, fetch_k, params=params)
+        labels = [int(r) for r in I[0] if 0 <= r < ntotal]
+        rows = list(dict.fromkeys(labels))  # FAISS may repeat labels
+        by_id = Chunk.objects.select_related("doc").in_bulk([int(table.chunk_ids[r]) for r in rows])
+        candidates, cand_rows = [], []
+        seen_hash = set()
+        n_resolved = 0
+        for r in rows:
+            c = by_id.get(int(table.chunk_ids[r]))
+            if c is None:
+                continue
+            n_resolved += 1
+            # Redundancy suppression: collapse exact-duplicate contents before MMR
+            h = hashlib.sha1((c.content or "").encode("utf-8")).digest()
+            if c.content and h in seen_hash:
+                continue
+            seen_hash.add(h)
+            candidates.append(c)
+            cand_rows.append(r)
+        if candidates:
+            # MMR compares candidates in the index's own space (image chunks are zero rows there)
+            if shared:
+                vecs = np.asarray(idx.vectors[cand_rows], dtype="float32")
+            else:
+                vecs = np.stack([idx.reconstruct(r) for r in cand_rows]).astype("float32")
+            groups = [c.doc_id for c in candidates]
+            order = mmr_select(qv[0], vecs, k, lambda_mult=lambda_mult, groups=groups, per_group_cap=per_doc_cap)
+            hits = [candidates[j] for j in order]
+        if len(hits) >= k or fetch_k >= n_eligible:
+            break
+        fetch_k = min(fetch_k * 2, n_eligible)
+    del bits
+    if stats is not None:
+        stats.update({"eligible": n_eligible, "fetched": len(labels), "original": n_resolved,
+                      "after_dedup": len(candidates), "returned": len(hits),
+                      "embed_s": round(t_embedded - t_start, 4), "scan_s": round(time.time() - t_embedded, 4)})
     return hits
 
 def answer1(q, k=5):
     ctxs = search(q, k)
     context_text = "\n\n".join(f"[{i}] {c.content[:800]}" for i,c in enumerate(ctxs) if c.kind=="text")
-    from openai import OpenAI
-    import time
-
-        # Read API key from file
-    with open(os.path.expanduser("~/.openai_api_key_gpt5")) as f:
-        api_key = f.read().strip()
-    client = OpenAI(api_key=api_key)
-
     msg = [
       {"role":"system","content":"You are a scholarly assistant. Cite brackets [i] from context."},
       {"role":"user","content":f"Question: {q}\n\nContext:\n{context_text}\n\nAnswer:"}
     ]
-    out = client.chat.completions.create(model="gpt-4o-mini", messages=msg, temperature=0.2)
+    out, _ = llm.chat(msg, model="gpt-4o-mini", temperature=0.2)
     return out.choices[0].message.content, ctxs
 
-def answer(q, k=5):
-    print("answer called with:", q, k)
-    original_ctxs = search(q, k)
-    # --- Redundancy suppression: collapse near-identical chunks (exact hash match) ---
-    import hashlib
-    seen_hash = {}
-    dedup_ctxs = []
-    old_to_new = {}
-    for idx, c in enumerate(original_ctxs):
-        text = (c.content or "")
-        h = hashlib.sha1(text.encode('utf-8')).hexdigest()
-        if h in seen_hash:
-            # duplicate: map to existing canonical index
-            old_to_new[idx] = seen_hash[h]
-            continue
-        new_index = len(dedup_ctxs)
-        seen_hash[h] = new_index
-        old_to_new[idx] = new_index
-        dedup_ctxs.append(c)
-    ctxs = dedup_ctxs
+def answer(q, k=5, per_doc_cap=None, **filters):
+    """RAG answer over ``search(q, k)``; ``filters`` are passed through to ``search``."""
+    print("answer called with:", q, k, filters)
+    t_start = time.time()
+    search_stats = {}
+    ctxs = search(q, k, per_doc_cap=per_doc_cap, stats=search_stats, **filters)
+    t_searched = time.time()
     print("search returned count:", len(ctxs))
 
-    def is_numeric_heavy(text: str) -> bool:
-        if not text:
-            return True
-        tokens = text.split()
-        if not tokens:
-            return True
-        digitish = sum(1 for t in tokens if sum(ch.isdigit() for ch in t) >= max(1, len(t)//2))
-        return digitish / max(1, len(tokens)) > 0.45  # skip tables/metrics
+    # Query-independent prep (sentence split, numeric filter, word sets, token counts)
+    # comes from the retrieval snapshot when it covers the chunk, else is computed here.
+    prepared = _prepared_chunks(ctxs)
 
     # Score chunks by simple keyword overlap (lowercase unique words from question)
-    q_words = {w for w in q.lower().split() if len(w) > 2}
+    q_words = lexical.question_words(q)
     scored = []
     for old_i, c in enumerate(ctxs):
-        if c.kind != "text":
+        prep = prepared[old_i]
+        if c.kind != "text" or prep is None:
             continue
-        txt = c.content.strip()
-        if not txt:
-            continue
-        if is_numeric_heavy(txt):
-            # attempt to salvage first non-numeric sentence
-            parts = [p.strip() for p in txt.split('.') if p.strip()]
-            for p in parts:
-                if not is_numeric_heavy(p):
-                    txt = p
-                    break
-            else:
-                continue  # give up if all numeric heavy
-        words = [w.strip('.,();:') for w in txt.lower().split()]
-        overlap = len(q_words.intersection(words))
-    # use current (deduped) index
-    scored.append((overlap, old_i, c, txt))
+        overlap = len(q_words & prep.words)
+        scored.append((overlap, old_i, c, prep))
 
     # sort by score desc, then index
     scored.sort(key=lambda x: (-x[0], x[1]))
 
     # Extract *relevant sentences* (not whole chunks) to give the model factual grounding
     # without dumping entire sections or tables.
-    import re
-    sent_split = re.compile(r'(?<=[.!?])\s+')
-
-    def clean_sentence(s: str) -> str:
-        s = s.strip()
-        # remove excessive whitespace
-        s = re.sub(r'\s+', ' ', s)
-        return s
-
-    q_words = {w for w in q.lower().split() if len(w) > 2}
     sentence_records = []  # (score, chunk_index, sentence)
-    for overlap, i, c, txt in scored[: k * 4]:  # look a bit deeper pool
-        sentences = [clean_sentence(s) for s in sent_split.split(txt) if len(s.strip()) > 20]
+    sentence_tokens = {}   # sentence text -> model tokens
+    for overlap, i, c, prep in scored[: k * 4]:  # look a bit deeper pool
         # score each sentence by overlap with question words
-        for snt in sentences:
-            words = {w.strip('.,();:') for w in snt.lower().split() if w}
-            score = len(q_words.intersection(words))
-            if score == 0:
+        for snt in prep.sentences:
+            score = len(q_words & snt.words)
+            if score == 0 and snt.has_caps:
                 # allow some high-information sentences by fallback heuristic: contains a keyword-like capitalized term
-                if any(ch.isupper() for ch in snt[:80]):
-                    score = 1
-            if score > 0 and not is_numeric_heavy(snt):
-                sentence_records.append((score, i, snt))
+                score = 1
+            if score > 0:
+                sentence_records.append((score, i, snt.text))
+                sentence_tokens[snt.text] = snt.tokens
 
     # sort sentences by score desc then chunk index
     sentence_records.sort(key=lambda x: (-x[0], x[1]))
@@ -141,30 +266,24 @@ def answer(q, k=5):
         uniq_sentence_records.append(rec)
     sentence_records = uniq_sentence_records
 
-    # Build concise snippet list with word budget
-    total_word_budget = 800
-    used_words = 0
-    per_chunk_cap = 3
-    per_chunk_counts = {}
-    snippet_list = []  # entries like [i] sentence
-    for score, i, snt in sentence_records:
-        if used_words >= total_word_budget:
-            break
-        per_chunk_counts.setdefault(i, 0)
-        if per_chunk_counts[i] >= per_chunk_cap:
-            continue
-        w = snt.split()
-        if used_words + len(w) > total_word_budget:
-            continue
-        snippet_list.append(f"[{i}] {snt}")
-        per_chunk_counts[i] += 1
-        used_words += len(w)
-    # fallback: if nothing gathered (e.g., very short question), include first sentence of top chunks
-    if not snippet_list:
-        for _, i, c, txt in scored[:k]:
-            first = sent_split.split(txt)[0].strip()[:400]
-            if first:
-                snippet_list.append(f"[{i}] {first}")
+    # Pack snippets into the token budget: reserve the fixed prompt parts (system,
+    # question, worst-case source lines) and the minimum answer, knapsack the rest.
+    candidate_sources = [f"[{i}] {getattr(c.doc, 'title', '')[:120]} (arXiv:{getattr(c.doc, 'arxiv_id', '')}) kind={c.kind} unit={c.ord}"
+                         for _, i, c, _ in scored]
+    overhead = packing.count_message_tokens([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Question: {q}\n\nSources:\n" + "\n".join(candidate_sources) + "\n\nSnippets:\n\n\nAnswer (cite sources with [index]):"},
+    ], model=llm.CHAT_MODEL)
+    snippet_budget = max(0, TOKEN_BUDGET - MIN_ANSWER_TOKENS - overhead)
+    packed, pack_stats = packing.pack_sentences(sentence_records, snippet_budget, per_chunk_cap=PER_CHUNK_SENTENCES,
+                                                model=llm.CHAT_MODEL,
+                                                token_counts=[sentence_tokens[r[2]] for r in sentence_records])
+    # fallback: if nothing gathered (e.g., very short question), include first sentence of top chunks,
+    # packed into the same budget (higher-ranked chunks preferred)
+    if not packed:
+        fallback = [(k - rank, i, prep.first) for rank, (_, i, c, prep) in enumerate(scored[:k]) if prep.first]
+        packed, pack_stats = packing.pack_sentences(fallback, snippet_budget, per_chunk_cap=1, model=llm.CHAT_MODEL)
+    snippet_list = [f"[{i}] {snt}" for _, i, snt in packed]  # entries like [i] sentence
     # Build source metadata lines (no raw content) for the model to cite.
     def extract_page(c):
         if c.kind == "image" and c.image_path:
@@ -205,23 +324,19 @@ def answer(q, k=5):
     sources_lines = [f"[{s['index']}] {s['paper']} (arXiv:{s['arxiv_id']}) kind={s['kind']} unit={s['page']}" for s in sources]
     grounding_lines = snippet_list
     context_text = "Sources:\n" + "\n".join(sources_lines) + "\n\nSnippets:\n" + "\n".join(grounding_lines)
-    from openai import OpenAI
-    with open(os.path.expanduser("~/.openai_api_key_gpt5")) as f:
-        api_key = f.read().strip()
-    client = OpenAI(api_key=api_key)
     msg = [
-        {"role":"system","content":"You are a scholarly assistant. Use the provided Sources metadata and Snippets (curated sentences) to answer accurately. Cite supporting source indices like [2] or [1,3]. Do NOT output large tables or full paragraphs; only synthesized prose. If a detail is not in snippets, state uncertainty. Keep answer focused; extra fluff discouraged."},
+        {"role":"system","content":SYSTEM_PROMPT},
         {"role":"user","content":f"Question: {q}\n\n{context_text}\n\nAnswer (cite sources with [index]):"}
     ]
-    preferred_model = os.environ.get("OPENAI_CHAT_MODEL", "gpt-4o")
+    # Answer length comes from whatever the prompt left of the budget (no post-hoc truncation)
+    prompt_tokens_est = packing.count_message_tokens(msg, model=llm.CHAT_MODEL)
+    max_tokens = min(MAX_ANSWER_TOKENS, max(MIN_ANSWER_TOKENS, TOKEN_BUDGET - prompt_tokens_est))
     t0 = time.time()
+    pack_s = t0 - t_searched
     usage = {}
-    model_used = preferred_model
-    try:
-        out = client.chat.completions.create(model=preferred_model, messages=msg, temperature=0.1, max_tokens=220)
-    except Exception:
-        model_used = "gpt-4o-mini"
-        out = client.chat.completions.create(model=model_used, messages=msg, temperature=0.1, max_tokens=220)
+    # pooled client, deadline, per-model circuit breaker, hedged fallback to gpt-4o-mini
+    out, llm_info = llm.chat(msg, temperature=0.1, max_tokens=max_tokens)
+    model_used = llm_info["model"]
     latency_s = time.time() - t0
     ans = out.choices[0].message.content.strip()
     # token usage if present
@@ -231,29 +346,33 @@ def answer(q, k=5):
             'completion_tokens': getattr(out.usage, 'completion_tokens', None),
             'total_tokens': getattr(out.usage, 'total_tokens', None)
         }
-    # Light length guard (optional): cap at ~160 words
-    words = ans.split()
-    if len(words) > 160:
-        ans = " ".join(words[:160]) + "…"
-    # Truncate raw context content before returning to UI & compute token counts
-    truncated_ctxs = []
-    context_token_counts = []
-    for c in ctxs:
-        text = (c.content or "")
-        toks = text.split()
-        context_token_counts.append(len(toks))
-        if len(text) > 1200:
-            text = text[:1200] + "…"
-        # shallow copy proxy (we'll rely on serializer for original model fields, override content attr temporarily)
-        c.content = text
-        truncated_ctxs.append(c)
+    usage.update({
+        'token_budget': TOKEN_BUDGET,
+        'prompt_tokens_est': prompt_tokens_est,
+        'max_tokens': max_tokens,
+        'snippet_tokens': pack_stats['snippet_tokens'],
+        'candidate_snippet_tokens': pack_stats['candidate_tokens'],
+        'prompt_tokens_saved': pack_stats['candidate_tokens'] - pack_stats['snippet_tokens'],
+    })
+    # Token counts per context; truncation for the UI happens in the serializers (ORM objects stay untouched)
+    context_token_counts = [packing.count_tokens(c.content or "", model=llm.CHAT_MODEL) for c in ctxs]
     meta = {
         'sources': sources,
         'snippets': snippet_list,
         'model': model_used,
         'usage': usage,
         'latency_s': round(latency_s, 3),
+        'llm': {'hedged': llm_info['hedged'], 'requests': llm_info['requests']},
         'context_token_counts': context_token_counts,
-        'dedup': {'original': len(original_ctxs), 'after_dedup': len(ctxs)}
+        'dedup': {'original': search_stats.get('original', len(ctxs)), 'after_dedup': search_stats.get('after_dedup', len(ctxs))},
+        'retrieval': search_stats,
+        # per-stage wall time (seconds); consumed by the loadtest command
+        'timings': {
+            'embed_s': search_stats.get('embed_s'),
+            'search_s': search_stats.get('scan_s'),
+            'pack_s': round(pack_s, 4),
+            'llm_s': round(latency_s, 4),
+            'total_s': round(time.time() - t_start, 4),
+        },
     }
-    return {'answer': ans, 'meta': meta}, truncated_ctxs
\ No newline at end of file
+    return {'answer': ans, 'meta': meta}, ctxs
\ No newline at end of file
@@ -1,17 +1,16 @@
 # rag/retrieval_mm.py
-import numpy as np, faiss
-from .ingest import get_embedder
+import numpy as np
+from .ingest import get_embedder, DIM
+from .mm import get_clip
+from .vectorstore import get_store
 from .models import Chunk
-from transformers import CLIPProcessor, CLIPModel
-import torch
-
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_proc  = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
 
 def text_score(q_vec, chunk_vecs):  # cosine via IP if normalized
     return (q_vec @ chunk_vecs.T).ravel()
 
 def image_score(q):
+    import torch
+    clip_model, clip_proc = get_clip()
     with torch.no_grad():
         t = clip_proc(text=[q], return_tensors="pt", padding=True)
         tv = clip_model.get_text_features(**t)
@@ -19,15 +18,17 @@ def image_score(q):
     return tv
 
 def search_mm(q, k=6):
-    # load all vectors (small demo). For prod, split text/image indexes.
-    chunks = list(Chunk.objects.all().order_by("id"))
-    vecs = np.stack([np.frombuffer(c.vector, dtype="float32") for c in chunks], axis=0)
+    # Vectors come from the columnar store; no Chunk row (or blob) is read until the final k.
+    store = get_store()
+    text_ids, text_vecs = store.all_vectors(dim=DIM)
+    img_ids, img_vecs = store.all_vectors(dim=int(get_clip()[0].config.projection_dim))
     # text sim
     embed = get_embedder(); qv = embed([q]).astype("float32")
     # image sim
     tv = image_score(q)
-    # late fusion
-    s = 0.6 * (qv @ vecs.T) + 0.4 * (tv @ vecs.T)
-    I = np.argsort(-s.ravel())[:k]
-    return [chunks[i] for i in I]
-
+    # late fusion: each modality is scored with its own query embedding
+    s = np.concatenate([0.6 * text_score(qv, text_vecs), 0.4 * text_score(tv, img_vecs)])
+    ids = np.concatenate([text_ids, img_ids])
+    I = np.argsort(-s)[:k]
+    by_id = Chunk.objects.in_bulk([int(ids[i]) for i in I])
+    return [by_id[int(ids[i])] for i in I if int(ids[i]) in by_id]
@@ -7,14 +7,64 @@ class ArxivFetchIn(serializers.Serializer):
     max_results = serializers.IntegerField(default=3)
 
 class AskIn(serializers.Serializer):
+    FILTER_FIELDS = ("arxiv_ids", "kinds", "added_after", "authors")
+
     question = serializers.CharField()
     multimodal = serializers.BooleanField(default=True)
     k = serializers.IntegerField(default=5)
+    lean = serializers.BooleanField(default=False)  # contexts as ids + snippets only
+    per_doc_cap = serializers.IntegerField(required=False, min_value=1)  # max contexts per paper
+    # Optional retrieval filters (applied inside the FAISS scan)
+    arxiv_ids = serializers.ListField(child=serializers.CharField(), required=False)
+    kinds = serializers.ListField(child=serializers.ChoiceField(choices=["text", "image"]), required=False)
+    added_after = serializers.DateTimeField(required=False)
+    authors = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def search_filters(self):
+        """Validated filter fields that were actually supplied, as ``search()`` kwargs."""
+        return {f: self.validated_data[f] for f in self.FILTER_FIELDS if self.validated_data.get(f)}
 
 class ChunkOut(serializers.ModelSerializer):
+    """Chunk with content truncated to MAX_CONTENT_CHARS (pass context={"full": True} for all of it)."""
+    MAX_CONTENT_CHARS = 1200
+
     class Meta:
         model = Chunk
-        fields = ("kind","content","image_path","ord")
+        fields = ("id","kind","content","image_path","ord")
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        text = data.get("content") or ""
+        if not self.context.get("full") and len(text) > self.MAX_CONTENT_CHARS:
+            data["content"] = text[:self.MAX_CONTENT_CHARS] + "…"
+        return data
+
+class ChunkLeanOut(serializers.ModelSerializer):
+    """Lean context entry: ids, citation metadata and a short snippet; full text via /api/chunks/<id>."""
+    SNIPPET_CHARS = 200
+
+    arxiv_id = serializers.CharField(source="doc.arxiv_id", read_only=True)
+    snippet = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Chunk
+        fields = ("id","kind","ord","image_path","arxiv_id","snippet")
+
+    def get_snippet(self, obj):
+        text = " ".join((obj.content or "")[:self.SNIPPET_CHARS * 2].split())
+        if len(text) <= self.SNIPPET_CHARS and len(obj.content or "") <= self.SNIPPET_CHARS * 2:
+            return text
+        return text[:self.SNIPPET_CHARS].rsplit(" ", 1)[0] + "…"
+
+class ChunkContentOut(ChunkOut):
+    arxiv_id = serializers.CharField(source="doc.arxiv_id", read_only=True)
+    title = serializers.CharField(source="doc.title", read_only=True)
+
+    class Meta(ChunkOut.Meta):
+        fields = ChunkOut.Meta.fields + ("arxiv_id","title")
+
+def contexts_out(ctxs, lean=False):
+    return (ChunkLeanOut if lean else ChunkOut)(ctxs, many=True).data
 
 class RAGAnswerOut(serializers.Serializer):
     answer = serializers.CharField()
@@ -0,0 +1,268 @@
+"""Shared, memory-mapped index serving for multi-worker deployments.
+
+With ``ARXRAG_SERVING=shared`` every worker process (e.g. gunicorn workers of
+``arxrag.wsgi``) maps the same on-disk "generation" read-only instead of loading
+its own copy of the FAISS index and Chunk vectors, so the OS page cache holds a
+single physical copy no matter how many workers run. Point
+``ARXRAG_SERVING_DIR`` at a tmpfs such as ``/dev/shm/arxrag`` to keep the
+generations in POSIX shared memory.
+
+Every publish (``reingest``, ingestion, ``publish_index``) also writes the
+retrieval snapshot used for warm starts in either mode: one memory-mappable
+file (``rag.snapshot``) holding the vectors, the row -> chunk id map, the
+compact chunk metadata and the query-independent sentence data ``answer()``
+needs (``rag.lexical``), so a fresh worker needs neither FAISS nor a full
+Chunk scan before its first answer.
+
+Layout::
+
+    <SERVING_DIR>/GENERATION         current generation number (atomically replaced)
+    <SERVING_DIR>/gen-000007.snap    one immutable generation
+        vectors                      float32 (n, d), row i == FAISS label i (shared mode only)
+        chunk_ids doc_ids kinds added_at          ChunkMetaTable columns
+        has_text chunk_sent_offsets               per row: prose kept? its sentence range
+        sent_caps sent_tokens                     per sentence: caps fallback flag, model tokens
+        chunk_words first sent_text sent_words    string columns (blob + offsets)
+        meta: docs (doc id -> [arxiv_id, lowercased authors]), token_model
+
+Writers hold ``<SERVING_DIR>/.lock`` while they pick the next generation
+number, write the file (through a unique temp name) and replace ``GENERATION``;
+readers ``stat`` that file on each request and re-attach when it names another
+generation or another file (inode / mtime), so an index swap never exposes a
+half-written generation. Generation numbers are never reused; ``_prune``
+removes old files.
+"""
+import os, threading, time
+import numpy as np
+from . import filelock, lexical, llm, packing, snapshot
+from .chunkmeta import ChunkMetaTable, KIND_CODES
+
+SERVING_MODE = os.environ.get("ARXRAG_SERVING", "faiss")   # "faiss" | "shared"
+SERVING_DIR = os.environ.get("ARXRAG_SERVING_DIR", "data/index/serving")
+GENERATION_FILE = os.path.join(SERVING_DIR, "GENERATION")
+KEEP_GENERATIONS = 2  # older ones may still be mapped by workers mid-request
+CONTENT_BATCH = 500   # chunk ids per content query (SQLite variable limit)
+
+_COLUMNS = ("chunk_ids", "doc_ids", "kinds", "added_at")
+
+
+def _gen_path(gen):
+    return os.path.join(SERVING_DIR, f"gen-{gen:06d}.snap")
+
+
+def read_generation():
+    try:
+        with open(GENERATION_FILE) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+class MappedIndex:
+    """Exact inner-product search over a memory-mapped vector matrix.
+
+    Same contract as ``IndexFlatIP.search`` (scores and labels, -1 for empty
+    slots); ``mask`` excludes rows during the scan.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.ntotal = int(vectors.shape[0])
+        self.d = int(vectors.shape[1]) if vectors.ndim == 2 else 0
+
+    def search(self, qv, k, mask=None):
+        scores = np.asarray(qv, dtype="float32") @ self.vectors.T   # (nq, ntotal)
+        if mask is not None:
+            scores[:, ~mask[: self.ntotal]] = -np.inf
+        k = min(k, self.ntotal)
+        D = np.full((scores.shape[0], k), -np.inf, dtype="float32")
+        I = np.full((scores.shape[0], k), -1, dtype=np.int64)
+        if k == 0:
+            return D, I
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        valid = np.isfinite(top_scores)
+        D[valid], I[valid] = top_scores[valid], top[valid]
+        return D, I
+
+
+class Generation:
+    """A read-only attachment to one published snapshot file."""
+
+    def __init__(self, gen):
+        self.gen = gen
+        st = os.stat(_gen_path(gen))
+        self.file_id = (st.st_ino, st.st_mtime_ns)
+        self.snap = snapshot.Snapshot(_gen_path(gen))
+        docs = {int(k): tuple(v) for k, v in self.snap.meta["docs"].items()}
+        self.table = ChunkMetaTable(*(self.snap[c] for c in _COLUMNS), docs, signature=("gen", gen))
+        # published outside shared mode: no vectors, searches go to the FAISS file
+        self.vectors = self.snap["vectors"] if "vectors" in self.snap else None
+        self.index = MappedIndex(self.vectors) if self.vectors is not None else None
+        self.token_model = self.snap.meta.get("token_model")
+        self._chunk_words = self.snap.strings("chunk_words")
+        self._first = self.snap.strings("first")
+        self._sent_text = self.snap.strings("sent_text")
+        self._sent_words = self.snap.strings("sent_words")
+
+    def prepared(self, chunk_ids):
+        """{chunk_id: lexical.PreparedChunk or None} for the ids this snapshot covers."""
+        snap = self.snap
+        has_text, sent_offsets = snap["has_text"], snap["chunk_sent_offsets"]
+        caps, tokens = snap["sent_caps"], snap["sent_tokens"]
+        out = {}
+        for cid, r in zip(chunk_ids, self.table.rows_for(chunk_ids)):
+            if r < 0:
+                continue
+            if not has_text[r]:
+                out[cid] = None
+                continue
+            sentences = tuple(
+                lexical.Sentence(self._sent_text[j], frozenset(self._sent_words[j].split()), bool(caps[j]), int(tokens[j]))
+                for j in range(int(sent_offsets[r]), int(sent_offsets[r + 1]))
+            )
+            out[cid] = lexical.PreparedChunk(frozenset(self._chunk_words[r].split()), self._first[r], sentences)
+        return out
+
+
+def build_arrays(vectors, table, contents, previous=None):
+    """Snapshot arrays for ``vectors`` + ``table`` + lexical prep of ``contents`` (chunk id -> text).
+
+    ``vectors`` may be None (FAISS serving mode): the snapshot then only holds
+    the metadata and sentence data.
+
+    Prep for chunk ids already in ``previous`` (a Generation) is copied instead of
+    recomputed, so an incremental ingest only tokenizes the new chunks.
+    """
+    n = len(table) if vectors is None else min(len(vectors), len(table))
+    ids = [int(c) for c in table.chunk_ids[:n]]
+    reused = previous.prepared(ids) if reusable(previous) else {}
+    count = lambda t: packing.count_tokens(t, model=llm.CHAT_MODEL)
+    has_text = np.zeros(n, dtype=bool)
+    sent_offsets = np.zeros(n + 1, dtype=np.int64)
+    chunk_words, first, sent_text, sent_words, caps, tokens = [], [], [], [], [], []
+    for r, cid in enumerate(ids):
+        prep = reused[cid] if cid in reused else lexical.prepare(contents.get(cid, ""), count)
+        if prep is not None:
+            has_text[r] = True
+            for snt in prep.sentences:
+                sent_text.append(snt.text)
+                sent_words.append(" ".join(sorted(snt.words)))
+                caps.append(snt.has_caps)
+                tokens.append(snt.tokens)
+        chunk_words.append(" ".join(sorted(prep.words)) if prep else "")
+        first.append(prep.first if prep else "")
+        sent_offsets[r + 1] = len(sent_text)
+    arrays = {} if vectors is None else {"vectors": np.asarray(vectors[:n], dtype="float32")}
+    arrays.update({c: np.asarray(getattr(table, c)[:n]) for c in _COLUMNS})
+    arrays.update({"has_text": has_text, "chunk_sent_offsets": sent_offsets,
+                   "sent_caps": np.asarray(caps, dtype=bool), "sent_tokens": np.asarray(tokens, dtype=np.int32)})
+    for name, col in (("chunk_words", chunk_words), ("first", first), ("sent_text", sent_text), ("sent_words", sent_words)):
+        arrays[name + "_blob"], arrays[name + "_offsets"] = snapshot.pack_strings(col)
+    return arrays, len(reused)
+
+
+def reusable(previous):
+    """True if ``previous``'s prepared data may be copied into a new generation."""
+    return previous is not None and previous.token_model == llm.CHAT_MODEL
+
+
+def publish(vectors, table, contents, previous=None):
+    """Write a new snapshot generation and make it current.
+
+    ``contents`` (chunk id -> text) must cover every text chunk that
+    ``previous`` does not; prep for the others is copied from it.
+    """
+    t0 = time.time()
+    arrays, n_reused = build_arrays(vectors, table, contents, previous=previous)
+    meta = {"docs": {str(k): list(v) for k, v in table.docs.items()}, "token_model": llm.CHAT_MODEL}
+    with filelock.locked(os.path.join(SERVING_DIR, ".lock")):
+        gen = read_generation() + 1
+        snapshot.write(_gen_path(gen), arrays, meta)
+        gen_tmp = GENERATION_FILE + ".tmp"
+        with open(gen_tmp, "w") as f:
+            f.write(str(gen))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(gen_tmp, GENERATION_FILE)
+        _prune(gen)
+    print(f"serving: published generation {gen} ({len(arrays['chunk_ids'])} rows, {n_reused} reused) "
+          f"in {time.time() - t0:.2f}s")
+    return gen
+
+
+def publish_from_index(idx, chunk_ids):
+    """Publish the vectors of a flat FAISS index (row i = ``chunk_ids[i]``) with their metadata.
+
+    Only the contents of text chunks the current generation does not cover are
+    read from the database, so an incremental ingest reads just its new chunks.
+    The vectors are copied out of the index only in shared mode, where workers
+    search the snapshot instead of FAISS.
+    """
+    from .models import Chunk
+    vectors = None
+    if SERVING_MODE == "shared":
+        vectors = idx.reconstruct_n(0, idx.ntotal) if idx.ntotal else np.zeros((0, idx.d), dtype="float32")
+    table = ChunkMetaTable.build(chunk_ids)
+    previous = current()
+    ids = table.chunk_ids[table.kinds == KIND_CODES["text"]]
+    if reusable(previous):
+        ids = ids[previous.table.rows_for(ids) < 0]
+    contents = {}
+    for start in range(0, len(ids), CONTENT_BATCH):
+        batch = ids[start:start + CONTENT_BATCH].tolist()
+        contents.update(Chunk.objects.filter(id__in=batch).values_list("id", "content"))
+    return publish(vectors, table, contents, previous=previous)
+
+
+def _prune(current):
+    for name in os.listdir(SERVING_DIR):
+        if name.startswith("gen-") and name.endswith(".snap"):
+            try:
+                g = int(name[4:-5])
+            except ValueError:
+                continue
+            if g <= current - KEEP_GENERATIONS:
+                # workers still mapping it keep their pages until they re-attach
+                os.remove(os.path.join(SERVING_DIR, name))
+
+
+def _file_id(gen):
+    try:
+        st = os.stat(_gen_path(gen))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+_lock = threading.Lock()
+_current = None
+_gen_mtime = None
+
+
+def current():
+    """Return the attached Generation, re-attaching if GENERATION changed; None if nothing is published."""
+    global _current, _gen_mtime
+    try:
+        mtime = os.stat(GENERATION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _current is not None and mtime == _gen_mtime:
+        return _current
+    with _lock:
+        if _current is None or mtime != _gen_mtime:
+            gen = read_generation()
+            if gen and (_current is None or _current.gen != gen or _current.file_id != _file_id(gen)):
+                t0 = time.time()
+                try:
+                    _current = Generation(gen)
+                except (OSError, ValueError) as e:
+                    # e.g. a pre-snapshot directory generation: serve from FAISS until the next publish
+                    print(f"serving: cannot attach generation {gen}: {e}")
+                    _current = None
+                else:
+                    print(f"serving: attached generation {gen} ({len(_current.table)} rows) in {1000 * (time.time() - t0):.1f} ms")
+            _gen_mtime = mtime
+        return _current
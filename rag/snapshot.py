@@ -0,0 +1,106 @@
+"""Single-file, memory-mappable container for retrieval snapshots.
+
+Layout::
+
+    b"ARXSNAP1" | u64 header length | JSON header | padding | array data ...
+
+The JSON header lists every array (dtype, shape, offset) plus free-form
+``meta``. Arrays start on 64-byte boundaries, so opening a snapshot is one
+``mmap`` and a header parse: arrays are zero-copy views into the mapping and
+pages are only read when touched (and shared between processes).
+
+Variable-length strings are stored as a UTF-8 blob plus int64 offsets
+(see ``pack_strings`` / ``StringColumn``).
+"""
+import os, json, tempfile
+import numpy as np
+
+MAGIC = b"ARXSNAP1"
+ALIGN = 64
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def pack_strings(strings):
+    """list[str] -> (uint8 blob, int64 offsets of length n+1)."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class StringColumn:
+    def __init__(self, blob, offsets):
+        self.blob, self.offsets = blob, offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+
+def write(path, arrays, meta=None):
+    """Write ``arrays`` (name -> ndarray) and ``meta`` to ``path`` atomically.
+
+    The data goes to a uniquely named temp file in the same directory first, so
+    concurrent writers never share a partial file.
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    specs, offset = {}, 0
+    for name, a in arrays.items():
+        specs[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset = _align(offset + a.nbytes)
+    header = json.dumps({"arrays": specs, "meta": meta or {}}).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)  # readable by workers running as another user, like a plain open()
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for name, a in arrays.items():
+                f.seek(data_start + specs[name]["offset"])
+                f.write(a.tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Snapshot:
+    """Read-only view of a snapshot file; ``snap[name]`` is a zero-copy array."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a retrieval snapshot")
+            hlen = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(hlen))
+        self.meta = header["meta"]
+        self._specs = header["arrays"]
+        self._data_start = _align(len(MAGIC) + 8 + hlen)
+        self._buf = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def __getitem__(self, name):
+        spec = self._specs[name]
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        start = self._data_start + spec["offset"]
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        return self._buf[start:start + nbytes].view(dtype).reshape(shape)
+
+    def strings(self, name):
+        return StringColumn(self[name + "_blob"], self[name + "_offsets"])
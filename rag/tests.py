@@ -1,3 +1,627 @@
-from django.test import TestCase
+import itertools, os, shutil, tempfile, threading, time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from . import chunkmeta, ingest, lexical, llm, packing, retrieval, serving, snapshot, vectorstore
+from .models import Chunk, Document
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeClient:
+    """Stands in for the pooled OpenAI client; ``chat`` maps model -> behaviour(call_no)."""
+
+    def __init__(self, chat=None, embed=None):
+        self.behaviour = chat or {}
+        self.embed_behaviour = embed
+        self.calls = []
+        self.embed_calls = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _chat(self, model, messages, timeout, **kwargs):
+        with self.lock:
+            self.calls.append(model)
+            n = self.calls.count(model)
+        return self.behaviour[model](n)
+
+    def _embed(self, model, input, timeout):
+        self.embed_calls += 1
+        return self.embed_behaviour(self.embed_calls)
+
+
+def answers(text, delay=0.0):
+    def run(_):
+        time.sleep(delay)
+        return text
+    return run
+
+
+def fails(status=500):
+    def run(_):
+        raise FakeAPIError(status)
+    return run
+
+
+class GatewayTests(SimpleTestCase):
+    def setUp(self):
+        llm._breakers.clear()
+        llm._latency.clear()
+        patcher = mock.patch.object(llm, "HEDGE_DELAY_S", 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, client):
+        patcher = mock.patch.object(llm, "get_client", lambda: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return client
+
+    def test_fast_primary_is_not_hedged(self):
+        client = self.use(FakeClient({"a": answers("A"), "b": answers("B")}))
+        out, info = llm.chat([], model="a", fallback="b")
+        self.assertEqual(out, "A")
+        self.assertEqual(info, {"model": "a", "hedged": False, "requests": 1})
+        self.assertEqual(client.calls, ["a"])
+
+    def test_slow_primary_is_hedged_to_fallback(self):
+        # distinct model names: the abandoned slow call finishes after the test
+        self.use(FakeClient({"slow": answers("A", delay=0.5), "b": answers("B")}))
+        out, info = llm.chat([], model="slow", fallback="b")
+        self.assertEqual(out, "B")
+        self.assertEqual(info, {"model": "b", "hedged": True, "requests": 2})
+
+    def test_failed_primary_falls_back_immediately(self):
+        self.use(FakeClient({"a": fails(), "b": answers("B")}))
+        t0 = time.monotonic()
+        out, info = llm.chat([], model="a", fallback="b", hedge=False)
+        self.assertEqual((out, info["model"], info["requests"]), ("B", "b", 2))
+        self.assertLess(time.monotonic() - t0, 0.5)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        client = self.use(FakeClient({"a": fails()}))
+        for _ in range(llm.BREAKER_FAILURES):
+            with self.assertRaisesRegex(llm.LLMError, "all models failed"):
+                llm.chat([], model="a", fallback=None, hedge=False)
+        with self.assertRaisesRegex(llm.LLMError, "circuit open"):
+            llm.chat([], model="a", fallback=None, hedge=False)
+        self.assertEqual(len(client.calls), llm.BREAKER_FAILURES)
+        self.assertEqual(llm.status()["a"]["state"], "open")
+
+    def test_rejected_requests_do_not_open_the_breaker(self):
+        client = self.use(FakeClient({"bad": fails(400)}))
+        for _ in range(llm.BREAKER_FAILURES + 1):
+            with self.assertRaisesRegex(llm.LLMError, "all models failed"):
+                llm.chat([], model="bad", fallback=None, hedge=False)
+        self.assertEqual(len(client.calls), llm.BREAKER_FAILURES + 1)
+        self.assertEqual(llm.status()["bad"]["state"], "closed")
+
+    def test_breaker_lets_one_trial_through_after_reset(self):
+        client = self.use(FakeClient({"a": lambda n: "A" if n > llm.BREAKER_FAILURES else fails()(n)}))
+        for _ in range(llm.BREAKER_FAILURES):
+            with self.assertRaises(llm.LLMError):
+                llm.chat([], model="a", fallback=None, hedge=False)
+        llm._breakers["a"].opened_at -= llm.BREAKER_RESET_S
+        out, _ = llm.chat([], model="a", fallback=None, hedge=False)
+        self.assertEqual(out, "A")
+        self.assertEqual(llm.status()["a"]["state"], "closed")
+
+    def test_deadline_is_enforced(self):
+        self.use(FakeClient({"hung": answers("A", delay=1.0)}))
+        t0 = time.monotonic()
+        with self.assertRaisesRegex(llm.LLMError, "deadline"):
+            llm.chat([], model="hung", fallback=None, hedge=False, deadline_s=0.1)
+        self.assertLess(time.monotonic() - t0, 0.5)
+
+
+class EmbeddingRetryTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(llm, "EMBED_BACKOFF_S", 0.001)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, client):
+        patcher = mock.patch.object(llm, "get_client", lambda: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return client
+
+    def test_transient_errors_are_retried(self):
+        def flaky(n):
+            if n <= 2:
+                raise FakeAPIError(429 if n == 1 else 503)
+            return "vectors"
+        client = self.use(FakeClient(embed=flaky))
+        self.assertEqual(llm.embeddings("m", ["x"]), "vectors")
+        self.assertEqual(client.embed_calls, 3)
+
+    def test_retries_are_bounded(self):
+        client = self.use(FakeClient(embed=fails(500)))
+        with self.assertRaises(FakeAPIError):
+            llm.embeddings("m", ["x"])
+        self.assertEqual(client.embed_calls, llm.EMBED_RETRIES + 1)
+
+    def test_client_errors_are_not_retried(self):
+        client = self.use(FakeClient(embed=fails(400)))
+        with self.assertRaises(FakeAPIError):
+            llm.embeddings("m", ["x"])
+        self.assertEqual(client.embed_calls, 1)
+
+
+def estimate_tokens(test):
+    """Count tokens with the chars/4 estimate so budgets do not depend on the tiktoken version."""
+    patcher = mock.patch.object(packing, "get_encoder", lambda model=None: None)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+class PackingTests(SimpleTestCase):
+    def setUp(self):
+        estimate_tokens(self)
+
+    def test_knapsack_is_optimal_within_budget(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            n = int(rng.integers(1, 9))
+            values = rng.integers(1, 20, n).tolist()
+            weights = rng.integers(1, 12, n).tolist()
+            budget = int(rng.integers(0, 30))
+            chosen = packing.knapsack(values, weights, budget)
+            self.assertLessEqual(sum(weights[i] for i in chosen), budget)
+            best = max(sum(values[i] for i in c) for r in range(n + 1)
+                       for c in itertools.combinations(range(n), r) if sum(weights[i] for i in c) <= budget)
+            self.assertEqual(sum(values[i] for i in chosen), best)
+
+    def test_knapsack_prefers_several_short_items(self):
+        self.assertEqual(packing.knapsack([5, 3, 3], [10, 5, 5], 10), [1, 2])
+        self.assertEqual(packing.knapsack([5], [10], 0), [])
+
+    def test_pack_sentences_caps_each_chunk(self):
+        records = [(4, 0, "a" * 40), (3, 0, "b" * 40), (2, 0, "c" * 40), (1, 1, "d" * 40)]
+        selected, stats = packing.pack_sentences(records, 1000, per_chunk_cap=2)
+        self.assertEqual(selected, [records[0], records[1], records[3]])
+        self.assertEqual(stats["candidate_tokens"], sum(packing.count_tokens(f"[{i}] {t}\n") for _, i, t in records))
+
+    def test_pack_sentences_respects_budget_and_order(self):
+        records = [(1, 0, "x" * 400), (2, 1, "y" * 40), (2, 2, "z" * 40)]
+        budget = 2 * packing.count_tokens("[1] " + "y" * 40 + "\n")
+        selected, stats = packing.pack_sentences(records, budget)
+        self.assertEqual(selected, records[1:])
+        self.assertLessEqual(stats["snippet_tokens"], budget)
+        # precomputed sentence counts plus the "[i] " prefix give the same costs
+        counts = [packing.count_tokens(t) for _, _, t in records]
+        self.assertEqual(packing.pack_sentences(records, budget, token_counts=counts), (selected, stats))
+
+
+
+class EncoderTests(SimpleTestCase):
+    def test_encoder_load_failure_falls_back_to_estimate(self):
+        with mock.patch.object(packing, "_encoders", {}), mock.patch.object(packing, "_load_failed", False), \
+                mock.patch.object(packing, "_load_encoder", side_effect=OSError("no network")), \
+                mock.patch("builtins.print") as log:
+            self.assertEqual(packing.count_tokens("x" * 40, model="gpt-4o"), 10)
+            self.assertEqual(packing.count_tokens("x" * 40, model="gpt-4o-mini"), 10)
+        self.assertEqual(log.call_count, 1)
+
+
+class AnswerFallbackTests(SimpleTestCase):
+    """No sentence overlaps the question: first sentences of the top chunks are packed instead."""
+
+    def setUp(self):
+        estimate_tokens(self)
+        body = "lorem ipsum dolor sit amet " * 14
+        self.ctxs = [SimpleNamespace(id=i, kind="text", content=f"{body}end. a short tail follows here.",
+                                     doc=SimpleNamespace(title="A paper", arxiv_id=f"2401.{i:05d}"),
+                                     ord=0, image_path="") for i in range(12)]
+        reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=" ok "))], usage=None)
+        for target, name, value in ((retrieval, "search", lambda q, k, **kw: self.ctxs[:k]),
+                                    (serving, "current", lambda: None),
+                                    (llm, "chat", mock.Mock(return_value=(reply, {"model": "m", "hedged": False, "requests": 1})))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fallback_fills_budget_with_top_ranked_first_sentences(self):
+        with mock.patch.object(packing, "pack_sentences", wraps=packing.pack_sentences) as pack:
+            result, _ = retrieval.answer("what about zebras", k=12)
+        self.assertEqual(pack.call_count, 2)
+        budget = pack.call_args.args[1]
+        usage = result["meta"]["usage"]
+        self.assertLessEqual(usage["snippet_tokens"], budget)
+        used = [int(s[1:s.index("]")]) for s in result["meta"]["snippets"]]
+        self.assertTrue(0 < len(used) < len(self.ctxs))  # budget binds
+        self.assertEqual(used, list(range(len(used))))   # higher-ranked chunks first
+        self.assertTrue(all(s.endswith("end.") for s in result["meta"]["snippets"]))
+        self.assertLessEqual(usage["prompt_tokens_est"], retrieval.TOKEN_BUDGET - retrieval.MIN_ANSWER_TOKENS)
+
+
+def unit(*xs):
+    v = np.asarray(xs, dtype="float32")
+    return v / np.linalg.norm(v)
+
+
+class MMRTests(SimpleTestCase):
+    def test_pure_relevance_order(self):
+        qv = unit(1, 0, 0)
+        vecs = np.stack([unit(0.2, 1, 0), unit(1, 0.1, 0), unit(0.6, 0, 1)])
+        self.assertEqual(retrieval.mmr_select(qv, vecs, 3, lambda_mult=1.0), [1, 2, 0])
+
+    def test_diversity_skips_near_duplicate(self):
+        qv = unit(1, 0, 0)
+        vecs = np.stack([unit(1, 0.01, 0), unit(1, 0.02, 0), unit(0.7, 0, 1)])
+        self.assertEqual(retrieval.mmr_select(qv, vecs, 2, lambda_mult=0.3), [0, 2])
+
+    def test_per_group_cap(self):
+        qv = unit(1, 0, 0)
+        vecs = np.stack([unit(1, 0.1 * i, 0) for i in range(4)] + [unit(0.3, 0, 1)])
+        picked = retrieval.mmr_select(qv, vecs, 3, groups=[1, 1, 1, 1, 2], per_group_cap=1)
+        self.assertEqual(picked, [0, 4])  # group 1 exhausted after one pick, nothing else left
+
+    def test_k_larger_than_candidates(self):
+        vecs = np.stack([unit(1, 0), unit(0, 1)])
+        self.assertEqual(sorted(retrieval.mmr_select(unit(1, 1), vecs, 5)), [0, 1])
+        self.assertEqual(retrieval.mmr_select(unit(1, 1), vecs[:0], 5), [])
+
+
+class SearchTests(TestCase):
+    """search() over an in-memory MappedIndex (no FAISS / embedding API needed)."""
+
+    def setUp(self):
+        dim = 8
+        e = np.eye(dim, dtype="float32")
+        self.docs = [Document.objects.create(arxiv_id=f"2401.0000{i}", title=f"Paper {i}", pdf_path="")
+                     for i in range(3)]
+        vecs = []
+        # doc 0: 20 near-identical chunks that outrank everything else
+        for i in range(20):
+            Chunk.objects.create(doc=self.docs[0], content=f"chunk a{i}", ord=i)
+            vecs.append(unit(*(e[0] + 0.01 * i * e[1])))
+        Chunk.objects.create(doc=self.docs[1], content="chunk b", ord=0)
+        vecs.append(unit(*(0.5 * e[0] + e[2])))
+        Chunk.objects.create(doc=self.docs[2], content="chunk c", ord=0)
+        vecs.append(unit(*(0.4 * e[0] + e[3])))
+        index = serving.MappedIndex(np.stack(vecs))
+        table = chunkmeta.ChunkMetaTable.build()
+        for target, value in (("_embed_query", lambda q: e[:1].copy()),
+                              ("_open_index", lambda: (index, table))):
+            patcher = mock.patch.object(retrieval, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_returns_k_hits(self):
+        hits = retrieval.search("q", k=5)
+        self.assertEqual(len(hits), 5)
+
+    def test_fetch_window_doubles_until_cap_is_satisfied(self):
+        stats = {}
+        hits = retrieval.search("q", k=3, per_doc_cap=1, stats=stats)
+        # the first window (k * FETCH_MULTIPLIER = 12) holds only doc 0 chunks
+        self.assertEqual(len(hits), 3)
+        self.assertEqual({c.doc_id for c in hits}, {d.id for d in self.docs})
+        self.assertEqual(stats["fetched"], 22)
+
+    def test_filters_restrict_hits(self):
+        hits = retrieval.search("q", k=5, arxiv_ids=["2401.00001"])
+        self.assertEqual([c.doc_id for c in hits], [self.docs[1].id])
+
+    def test_index_table_mismatch_is_an_error(self):
+        index, table = retrieval._open_index()
+        short = chunkmeta.ChunkMetaTable.build(table.chunk_ids[:-1])
+        with mock.patch.object(retrieval, "_open_index", lambda: (index, short)):
+            with self.assertRaises(RuntimeError):
+                retrieval.search("q", k=3)
+
+    def test_table_for_saved_ids_marks_deleted_chunks(self):
+        ids = list(Chunk.objects.order_by("id").values_list("id", flat=True))
+        Chunk.objects.filter(id=ids[0]).delete()
+        table = chunkmeta.ChunkMetaTable.build(ids)
+        self.assertEqual(table.chunk_ids.tolist(), ids)  # rows still line up with the index
+        self.assertEqual((table.doc_ids[0], table.kinds[0]), (-1, -1))
+        self.assertFalse(table.mask(kinds=["text"])[0])
+        self.assertTrue(table.mask(kinds=["text"])[1:].all())
+
+
+def temp_dir(test):
+    path = tempfile.mkdtemp(prefix="arxrag-test-")
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def patch_attrs(test, target, **values):
+    for name, value in values.items():
+        patcher = mock.patch.object(target, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class VectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = temp_dir(self)
+        patch_attrs(self, vectorstore, STORE_DIR=self.dir, _store=None)
+        self.addCleanup(vectorstore.invalidate)
+
+    def vecs(self, n, d, value):
+        return np.full((n, d), value, dtype="float32")
+
+    def test_newest_segment_wins(self):
+        vectorstore.append([1, 2, 3], self.vecs(3, 4, 1.0))
+        vectorstore.append([2], self.vecs(1, 4, 2.0))
+        store = vectorstore.VectorStore(self.dir)
+        self.assertEqual(store.ids.tolist(), [1, 2, 3])
+        np.testing.assert_array_equal(store.get([3, 2, 1])[:, 0], [1.0, 2.0, 1.0])
+        with self.assertRaises(KeyError):
+            store.get([4])
+
+    def test_mixed_dimensions(self):
+        vectorstore.append([1, 2], self.vecs(2, 4, 1.0))
+        vectorstore.append([3], self.vecs(1, 2, 3.0))
+        store = vectorstore.VectorStore(self.dir)
+        self.assertEqual((store.dim(1), store.dim(3)), (4, 2))
+        with self.assertRaises(ValueError):
+            store.get([1, 3])
+        ids, vecs = store.all_vectors(dim=2)
+        self.assertEqual((ids.tolist(), vecs.shape), ([3], (1, 2)))
+        ids, vecs = store.all_vectors(dim=4, chunk_ids=[2, 3])
+        self.assertEqual((ids.tolist(), vecs.shape), ([2], (1, 4)))
+
+    def test_compact_drops_dead_ids_and_old_segments(self):
+        vectorstore.append([1, 2], self.vecs(2, 4, 1.0))
+        vectorstore.append([3, 4], self.vecs(2, 4, 2.0))
+        vectorstore.append([2], self.vecs(1, 4, 5.0))
+        vectorstore.append([7], self.vecs(1, 2, 7.0))
+        with mock.patch.object(vectorstore, "COMPACT_BATCH", 1):
+            self.assertEqual(vectorstore.compact(live_ids=[2, 3, 7]), 4)
+        self.assertEqual(vectorstore.segment_count(), 2)  # one per dimension
+        store = vectorstore.get_store()
+        self.assertEqual(store.ids.tolist(), [2, 3, 7])
+        np.testing.assert_array_equal(store.get([2, 3])[:, 0], [5.0, 2.0])
+        np.testing.assert_array_equal(store.get([7]), self.vecs(1, 2, 7.0))
+        self.assertEqual(vectorstore.compact(live_ids=[2, 3, 7]), 0)  # already compact
+        self.assertFalse([n for n in os.listdir(self.dir) if "tmp" in n])
+
+    def test_store_sees_own_writes_immediately(self):
+        vectorstore.append([1], self.vecs(1, 4, 1.0))
+        self.assertEqual(len(vectorstore.get_store()), 1)
+        vectorstore.append([2], self.vecs(1, 4, 1.0))
+        self.assertEqual(len(vectorstore.get_store()), 2)
+
+
+class MigrationTestCase(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([("rag", target)])
+        return MigrationExecutor(connection).loader.project_state([("rag", target)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+class VectorMigrationTests(MigrationTestCase):
+    def test_0002_moves_vectors_to_store_and_back(self):
+        store_dir = temp_dir(self)
+        patch_attrs(self, vectorstore, STORE_DIR=store_dir)
+        apps = self.migrate("0001_initial")
+        Document, Chunk_ = apps.get_model("rag", "Document"), apps.get_model("rag", "Chunk")
+        doc = Document.objects.create(arxiv_id="2401.00001v1", title="t", pdf_path="")
+        text = np.arange(4, dtype="float32")
+        image = np.arange(2, dtype="float32") + 10
+        c1 = Chunk_.objects.create(doc=doc, content="a", vector=text.tobytes())
+        c2 = Chunk_.objects.create(doc=doc, kind="image", vector=image.tobytes())
+        c3 = Chunk_.objects.create(doc=doc, content="no vector", vector=b"")
+
+        self.migrate("0002_move_vectors_to_store")
+        store = vectorstore.VectorStore(store_dir)
+        self.assertEqual(store.ids.tolist(), [c1.id, c2.id])
+        np.testing.assert_array_equal(store.get([c1.id])[0], text)
+        np.testing.assert_array_equal(store.get([c2.id])[0], image)
+
+        apps = self.migrate("0001_initial")
+        Chunk_ = apps.get_model("rag", "Chunk")
+        blobs = dict(Chunk_.objects.values_list("id", "vector"))
+        self.assertEqual(bytes(blobs[c1.id]), text.tobytes())
+        self.assertEqual(bytes(blobs[c2.id]), image.tobytes())
+        self.assertEqual(bytes(blobs[c3.id]), b"")
+
+
+class VersionMigrationTests(MigrationTestCase):
+    def test_0003_splits_versions_and_drops_duplicate_documents(self):
+        apps = self.migrate("0002_move_vectors_to_store")
+        Document, Chunk_ = apps.get_model("rag", "Document"), apps.get_model("rag", "Chunk")
+        make = lambda aid: Document.objects.create(arxiv_id=aid, title=aid, pdf_path="")
+        v1, v2_old, v2_new, other = make("2401.00001v1"), make("2401.00001v2"), make("2401.00001v2"), make("2402.00002")
+        for doc in (v1, v2_old, v2_new):
+            Chunk_.objects.create(doc=doc, content=doc.title)
+
+        apps = self.migrate("0003_document_version_savedquery")
+        Document, Chunk_ = apps.get_model("rag", "Document"), apps.get_model("rag", "Chunk")
+        self.assertEqual(sorted(Document.objects.values_list("id", "arxiv_id", "version")),
+                         [(v2_new.id, "2401.00001", 2), (other.id, "2402.00002", 1)])
+        self.assertEqual(list(Chunk_.objects.values_list("doc_id", flat=True)), [v2_new.id])
+
+
+def fake_result(short_id, title="A paper"):
+    return SimpleNamespace(get_short_id=lambda: short_id, title=title,
+                           authors=[SimpleNamespace(name="Ada Lovelace")], download_pdf=mock.Mock())
+
+
+class FakeReader:
+    """Stands in for pypdf.PdfReader: one page per paragraph of the result's title."""
+    def __init__(self, path):
+        self.pages = [SimpleNamespace(extract_text=lambda t=t: t) for t in FakeReader.text[path].split("\n")]
+
+
+def fake_embed(texts):
+    vecs = np.zeros((len(texts), ingest.DIM), dtype="float32")
+    for i, t in enumerate(texts):
+        vecs[i, sum(map(ord, t)) % ingest.DIM] = 2.0
+    return vecs
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        root = temp_dir(self)
+        index = os.path.join(root, "faiss_text.index")
+        patch_attrs(self, ingest, INDEX_PATH=index, IDS_PATH=index + ".ids.npy", INDEX_LOCK=index + ".lock",
+                    chunk_text=lambda pages: [p for p in pages if p])
+        patch_attrs(self, vectorstore, STORE_DIR=os.path.join(root, "vectors"), _store=None)
+        self.addCleanup(vectorstore.invalidate)
+        self.embed = mock.Mock(side_effect=fake_embed)
+        patch_attrs(self, ingest, get_embedder=lambda: self.embed)
+        self.publish = mock.Mock()
+        patch_attrs(self, serving, publish_from_index=self.publish)
+        FakeReader.text = {}
+        patcher = mock.patch("pypdf.PdfReader", FakeReader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_ingest(self, *results):
+        for r in results:
+            FakeReader.text[f"data/pdfs/{r.get_short_id()}.pdf"] = r.title
+        return ingest.ingest_results(results)
+
+    def assert_index_matches_chunks(self):
+        idx, ids = ingest.load_index()
+        live = list(Chunk.objects.order_by("id").values_list("id", flat=True))
+        self.assertEqual(ids.tolist(), live)
+        self.assertEqual(idx.ntotal, len(live))
+
+    def test_unchanged_version_is_skipped_before_embedding(self):
+        summary = self.run_ingest(fake_result("2401.00001v1", "intro\nmethod"))
+        self.assertEqual(summary["added"], ["2401.00001v1"])
+        self.assertEqual(self.embed.call_count, 1)
+        r = fake_result("2401.00001v1", "intro\nmethod")
+        summary = self.run_ingest(r)
+        self.assertEqual(summary, {"added": [], "updated": [], "skipped": ["2401.00001v1"]})
+        self.assertEqual(self.embed.call_count, 1)
+        r.download_pdf.assert_not_called()
+        self.assertEqual(Chunk.objects.count(), 2)
+        self.assert_index_matches_chunks()
+
+    def test_newer_version_replaces_document(self):
+        self.run_ingest(fake_result("2401.00001v1", "old intro\nold method"), fake_result("2401.00002v1", "other"))
+        summary = self.run_ingest(fake_result("2401.00001v2", "new intro"))
+        self.assertEqual(summary["updated"], ["2401.00001v2"])
+        doc = Document.objects.get(arxiv_id="2401.00001")
+        self.assertEqual(doc.version, 2)
+        self.assertEqual(list(doc.chunk_set.values_list("content", flat=True)), ["new intro"])
+        self.assertEqual(Chunk.objects.count(), 2)
+        self.assert_index_matches_chunks()
+        self.assertEqual(vectorstore.get_store(refresh=True).ids.tolist(),
+                         list(Chunk.objects.order_by("id").values_list("id", flat=True)))
+
+    def test_failed_embedding_leaves_nothing_and_is_retried(self):
+        self.embed.side_effect = [RuntimeError("embedding service down"), fake_embed(["x"])]
+        with self.assertRaises(RuntimeError):
+            self.run_ingest(fake_result("2401.00001v1", "intro"))
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(len(vectorstore.VectorStore(vectorstore.STORE_DIR)), 0)
+        summary = self.run_ingest(fake_result("2401.00001v1", "intro"))
+        self.assertEqual(summary["added"], ["2401.00001v1"])
+        self.assertEqual(Chunk.objects.count(), 1)
+        self.assert_index_matches_chunks()
+
+    def test_failed_write_rolls_back_the_document(self):
+        with mock.patch.object(vectorstore, "append", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.run_ingest(fake_result("2401.00001v1", "intro"))
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(Chunk.objects.exists())
+        self.assertEqual(self.run_ingest(fake_result("2401.00001v1", "intro"))["added"], ["2401.00001v1"])
+
+    def test_index_out_of_step_with_chunks_is_rebuilt(self):
+        self.run_ingest(fake_result("2401.00001v1", "intro\nmethod"))
+        Chunk.objects.order_by("id").first().delete()  # committed without an index save
+        self.run_ingest(fake_result("2401.00002v1", "other"))
+        self.assertEqual(Chunk.objects.count(), 2)
+        self.assert_index_matches_chunks()
+
+
+class SnapshotTests(SimpleTestCase):
+    def test_round_trip(self):
+        path = os.path.join(temp_dir(self), "x.snap")
+        blob, offsets = snapshot.pack_strings(["", "héllo", "wörld"])
+        arrays = {"vectors": np.arange(12, dtype="float32").reshape(4, 3), "flags": np.array([True, False, True]),
+                  "empty": np.zeros((0, 5), dtype=np.int64), "s_blob": blob, "s_offsets": offsets}
+        snapshot.write(path, arrays, {"docs": {"1": ["2401.00001", "ada"]}})
+        snapshot.write(path, arrays, {"docs": {"1": ["2401.00001", "ada"]}})  # replaces in place
+        snap = snapshot.Snapshot(path)
+        for name, a in arrays.items():
+            self.assertEqual((snap[name].dtype, snap[name].shape), (a.dtype, a.shape))
+            np.testing.assert_array_equal(snap[name], a)
+        self.assertEqual(list(snap.strings("s")[i] for i in range(3)), ["", "héllo", "wörld"])
+        self.assertEqual(snap.meta, {"docs": {"1": ["2401.00001", "ada"]}})
+        self.assertNotIn("missing", snap)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["x.snap"])
+
+    def test_rejects_other_files(self):
+        path = os.path.join(temp_dir(self), "x.snap")
+        with open(path, "wb") as f:
+            f.write(b"not a snapshot at all")
+        with self.assertRaises(ValueError):
+            snapshot.Snapshot(path)
+
+
+class GenerationTests(SimpleTestCase):
+    contents = {
+        1: "Retrieval augmented generation grounds answers in documents. It was proposed in 2020 by Lewis et al.",
+        2: "12 34 56 78 90 11 22 33",                                      # numeric only: no prose
+        3: "",                                                             # image chunk
+        5: "short. But this sentence is long enough to be kept as prose!",
+    }
+
+    def setUp(self):
+        estimate_tokens(self)
+        root = temp_dir(self)
+        patch_attrs(self, serving, SERVING_DIR=root, GENERATION_FILE=os.path.join(root, "GENERATION"),
+                    _current=None, _gen_mtime=None)
+        ids = np.array(sorted(self.contents), dtype=np.int64)
+        self.table = chunkmeta.ChunkMetaTable(ids, np.array([7, 7, 7, 8]), np.array([0, 0, 1, 0], dtype=np.int8),
+                                              np.zeros(4), {7: ("2401.00001", "lewis"), 8: ("2401.00002", "")})
+        self.vectors = np.eye(4, dtype="float32")
+
+    def expected(self, ids):
+        count = lambda t: packing.count_tokens(t, model=llm.CHAT_MODEL)
+        return {cid: lexical.prepare(self.contents[cid], count) for cid in ids if cid in self.contents}
+
+    def test_prepared_matches_lexical_prepare(self):
+        gen = serving.publish(self.vectors, self.table, self.contents)
+        attached = serving.current()
+        self.assertEqual(attached.gen, gen)
+        self.assertEqual(attached.prepared([5, 1, 2, 3, 4]), self.expected([5, 1, 2, 3]))
+        self.assertEqual(attached.table.docs, self.table.docs)
+        np.testing.assert_array_equal(attached.table.kinds, self.table.kinds)
+
+    def test_next_generation_reuses_prep_without_contents(self):
+        first = serving.publish(self.vectors, self.table, self.contents)
+        second = serving.publish(self.vectors, self.table, {}, previous=serving.current())
+        self.assertEqual(second, first + 1)
+        self.assertEqual(serving.current().prepared([1, 2, 3, 5]), self.expected([1, 2, 3, 5]))
+
+    def test_vectors_only_when_given(self):
+        serving.publish(None, self.table, self.contents)
+        gen = serving.current()
+        self.assertIsNone(gen.index)
+        self.assertEqual(gen.prepared([1]), self.expected([1]))
+        serving.publish(self.vectors, self.table, self.contents)
+        gen = serving.current()
+        _, labels = gen.index.search(self.vectors[2:3], 1)
+        self.assertEqual(labels.tolist(), [[2]])
+
+    def test_old_generations_are_pruned(self):
+        for _ in range(serving.KEEP_GENERATIONS + 2):
+            gen = serving.publish(None, self.table, self.contents)
+        snaps = sorted(n for n in os.listdir(serving.SERVING_DIR) if n.endswith(".snap"))
+        self.assertEqual(snaps, [f"gen-{g:06d}.snap" for g in range(gen - serving.KEEP_GENERATIONS + 1, gen + 1)])
+        self.assertFalse([n for n in os.listdir(serving.SERVING_DIR) if n.endswith(".tmp")])
@@ -0,0 +1,237 @@
+"""Append-only columnar vector store addressed by chunk id.
+
+Chunk embeddings live outside SQLite as raw ``.npy`` segments so ORM rows stay
+small and scans/rebuilds read vectors straight from memory-mapped files::
+
+    <STORE_DIR>/seg-000001.vecs.npy   float32 (n, d)
+    <STORE_DIR>/seg-000001.ids.npy    int64   (n,)   chunk ids, one per row
+
+A segment is immutable once written; the ``.ids.npy`` file is renamed into place
+last, so a segment without it is an interrupted write and is ignored. Writers
+(``append``, ``compact``) hold an exclusive lock on ``<STORE_DIR>/.lock`` while
+they pick the next segment number and write, and stage files under
+process-unique temp names. Segments
+may have different dimensions (text vs. CLIP image embeddings). When the same
+chunk id appears in several segments the newest one wins.
+
+``compact()`` rewrites the live vectors into one segment per dimension and
+drops the old segments, reclaiming vectors of deleted chunks; ingestion runs
+it whenever more than ``MAX_SEGMENTS`` segments have accumulated and
+``rebuild_index`` runs it every time.
+"""
+import os, threading, time, uuid
+import numpy as np
+from . import filelock
+
+STORE_DIR = os.environ.get("ARXRAG_VECTOR_DIR", "data/vectors")
+MAX_SEGMENTS = 16
+CHECK_INTERVAL_S = 5.0     # how stale get_store() may be w.r.t. other processes' writes
+COMPACT_BATCH = 8192       # rows copied per step while compacting
+
+
+def _segment_names(store_dir):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(n[: -len(".ids.npy")] for n in os.listdir(store_dir) if n.endswith(".ids.npy"))
+
+
+def append(chunk_ids, vecs, store_dir=None):
+    """Persist ``vecs[i]`` for ``chunk_ids[i]`` as a new segment; returns the segment name."""
+    store_dir = store_dir or STORE_DIR
+    ids = np.asarray(chunk_ids, dtype=np.int64)
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    if vecs.ndim != 2 or len(ids) != len(vecs):
+        raise ValueError(f"expected (n, d) vectors for {len(ids)} ids, got shape {vecs.shape}")
+    with filelock.locked(_lock_path(store_dir)):
+        base, name = _next_segment(store_dir)
+        tmp = _tmp_name(base, "vecs")
+        np.save(tmp, vecs)
+        os.replace(tmp, base + ".vecs.npy")
+        _commit_ids(base, ids)
+    invalidate()
+    return name
+
+
+def _lock_path(store_dir):
+    return os.path.join(store_dir, ".lock")
+
+
+def _tmp_name(base, kind):
+    # np.save appends ".npy" unless the name already ends with it, hence the ".tmp.npy" spelling
+    return f"{base}.{kind}.{os.getpid()}-{uuid.uuid4().hex}.tmp.npy"
+
+
+def _next_segment(store_dir):
+    """Next free segment path; callers hold the store lock."""
+    os.makedirs(store_dir, exist_ok=True)
+    names = _segment_names(store_dir)
+    seq = int(names[-1].split("-")[1]) + 1 if names else 1
+    name = f"seg-{seq:06d}"
+    return os.path.join(store_dir, name), name
+
+
+def _commit_ids(base, ids):
+    tmp = _tmp_name(base, "ids")
+    np.save(tmp, ids)
+    os.replace(tmp, base + ".ids.npy")
+
+
+def compact(live_ids=None, store_dir=None):
+    """Rewrite the current vector of every live chunk id into one segment per dimension.
+
+    ``live_ids`` restricts the rewrite to those chunk ids (vectors of other ids,
+    e.g. deleted chunks, are dropped); ``None`` keeps every stored id. Vectors
+    are copied in ``COMPACT_BATCH``-row steps into memory-mapped output files,
+    and the old segments are removed only after the new ones are complete.
+    Returns the number of segments removed (0 if the store was already compact).
+    """
+    store_dir = store_dir or STORE_DIR
+    with filelock.locked(_lock_path(store_dir)):
+        removed = _compact(live_ids, store_dir)
+    if removed:
+        invalidate()
+    return removed
+
+
+def _compact(live_ids, store_dir):
+    store = VectorStore(store_dir)
+    old = list(store.names)
+    keep = np.ones(len(store), dtype=bool) if live_ids is None else \
+        np.isin(store.ids, np.asarray(live_ids, dtype=np.int64))
+    seg_dims = np.array([s[1].shape[1] for s in store.segments], dtype=np.int64)
+    row_dims = seg_dims[store._seg] if len(store) else np.zeros(0, np.int64)
+    dims = np.unique(row_dims[keep])
+    if keep.all() and len(old) == len(np.unique(seg_dims)):
+        return 0
+    for d in dims:
+        ids = store.ids[keep & (row_dims == d)]
+        base, _ = _next_segment(store_dir)
+        tmp = _tmp_name(base, "vecs")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(len(ids), int(d)))
+        for start in range(0, len(ids), COMPACT_BATCH):
+            out[start:start + COMPACT_BATCH] = store.get(ids[start:start + COMPACT_BATCH])
+        out.flush()
+        del out
+        os.replace(tmp, base + ".vecs.npy")
+        _commit_ids(base, ids)
+    del store
+    for n in old:
+        base = os.path.join(store_dir, n)
+        # ids first: a segment without its ids file is ignored by readers
+        os.remove(base + ".ids.npy")
+        os.remove(base + ".vecs.npy")
+    return len(old)
+
+
+def segment_count(store_dir=None):
+    return len(_segment_names(store_dir or STORE_DIR))
+
+
+class VectorStore:
+    """Read view over all segments in ``store_dir`` (memory-mapped, zero-copy slices)."""
+
+    def __init__(self, store_dir, previous=None):
+        self.store_dir = store_dir
+        self.names = _segment_names(store_dir)
+        # segments are immutable, so mappings of an earlier view can be reused
+        known = dict(zip(previous.names, previous.segments)) \
+            if previous is not None and previous.store_dir == store_dir else {}
+        self.segments = []
+        for n in self.names:
+            if n in known:
+                self.segments.append(known[n])
+                continue
+            base = os.path.join(store_dir, n)
+            self.segments.append((np.load(base + ".ids.npy", mmap_mode="r"),
+                                  np.load(base + ".vecs.npy", mmap_mode="r")))
+        if self.segments:
+            ids = np.concatenate([s[0] for s in self.segments])
+            seg = np.concatenate([np.full(len(s[0]), i, dtype=np.int32) for i, s in enumerate(self.segments)])
+            row = np.concatenate([np.arange(len(s[0]), dtype=np.int64) for s in self.segments])
+        else:
+            ids = np.zeros(0, np.int64); seg = np.zeros(0, np.int32); row = np.zeros(0, np.int64)
+        # stable sort by id, then keep the last (newest) occurrence of each id
+        order = np.argsort(ids, kind="stable")
+        ids, seg, row = ids[order], seg[order], row[order]
+        last = np.ones(len(ids), dtype=bool)
+        last[:-1] = ids[1:] != ids[:-1]
+        self.ids, self._seg, self._row = ids[last], seg[last], row[last]
+
+    def __len__(self):
+        return int(self.ids.size)
+
+    def __contains__(self, chunk_id):
+        pos = np.searchsorted(self.ids, chunk_id)
+        return bool(pos < len(self.ids) and self.ids[pos] == chunk_id)
+
+    def _locate(self, chunk_ids):
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        pos = np.searchsorted(self.ids, ids)
+        ok = pos < len(self.ids)
+        ok[ok] = self.ids[pos[ok]] == ids[ok]
+        if not ok.all():
+            raise KeyError(f"no stored vector for chunk ids {ids[~ok][:10].tolist()}")
+        return pos
+
+    def dim(self, chunk_id):
+        pos = self._locate([chunk_id])[0]
+        return int(self.segments[self._seg[pos]][1].shape[1])
+
+    def get(self, chunk_ids):
+        """(n, d) float32 matrix for ``chunk_ids`` in the given order (all must share one dimension)."""
+        pos = self._locate(chunk_ids)
+        if not len(pos):
+            return np.zeros((0, 0), dtype="float32")
+        segs = self._seg[pos]
+        dims = {int(self.segments[s][1].shape[1]) for s in np.unique(segs)}
+        if len(dims) != 1:
+            raise ValueError(f"requested chunks have mixed vector dimensions {sorted(dims)}")
+        out = np.empty((len(pos), dims.pop()), dtype="float32")
+        for s in np.unique(segs):
+            sel = segs == s
+            out[sel] = self.segments[s][1][self._row[pos[sel]]]
+        return out
+
+    def all_vectors(self, dim=None, chunk_ids=None):
+        """``(ids, vecs)`` sorted by chunk id, optionally restricted to a dimension and/or id set."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if dim is not None and self.segments:
+            seg_dims = np.array([s[1].shape[1] for s in self.segments], dtype=np.int64)
+            mask &= seg_dims[self._seg] == dim
+        if chunk_ids is not None:
+            mask &= np.isin(self.ids, np.asarray(chunk_ids, dtype=np.int64))
+        ids = self.ids[mask]
+        if not len(ids):
+            return ids, np.zeros((0, dim or 0), dtype="float32")
+        return ids, self.get(ids)
+
+
+_lock = threading.Lock()
+_store = None
+_checked_at = float("-inf")
+
+
+def get_store(refresh=False):
+    """Process-wide VectorStore.
+
+    The segment list is re-read at most every ``CHECK_INTERVAL_S`` seconds (or
+    right away with ``refresh=True``, or after a write in this process); only
+    segments that are new since the last view are opened.
+    """
+    global _store, _checked_at
+    now = time.monotonic()
+    store = _store
+    if store is not None and not refresh and now - _checked_at < CHECK_INTERVAL_S:
+        return store
+    with _lock:
+        names = _segment_names(STORE_DIR)
+        if _store is None or _store.names != names:
+            _store = VectorStore(STORE_DIR, previous=_store)
+        _checked_at = now
+        return _store
+
+
+def invalidate():
+    global _checked_at
+    with _lock:
+        _checked_at = float("-inf")
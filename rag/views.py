@@ -3,13 +3,37 @@ from django.shortcuts import render
 # Create your views here.
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .serializers import AskIn, RAGAnswerOut, ChunkOut
+from rest_framework import status
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
+from .models import Chunk
+from .serializers import AskIn, RAGAnswerOut, ChunkOut, ChunkContentOut, contexts_out
 from .retrieval import answer as rag_answer
+from .llm import LLMError
 from django.shortcuts import render
 def home(_): return render(_, "index.html")
 
+def _chunk_etag(request, chunk_id):
+    # chunk rows are immutable (a new paper version gets new chunk ids), so the id is the version
+    return f"chunk-{chunk_id}"
+
+@etag(_chunk_etag)
+@api_view(["GET"])
+def chunk_content(request, chunk_id):
+    """Full content of one chunk, for lean ask responses; revalidates with If-None-Match."""
+    c = get_object_or_404(Chunk.objects.select_related("doc"), pk=chunk_id)
+    resp = Response(ChunkContentOut(c, context={"full": True}).data)
+    patch_cache_control(resp, public=True, max_age=86400)
+    return resp
+
 @api_view(["POST"])
 def ask(request):
     s = AskIn(data=request.data); s.is_valid(raise_exception=True)
-    result, ctxs = rag_answer(s.validated_data["question"], s.validated_data["k"])
-    return Response({"answer": result["answer"], "meta": result.get("meta", {}), "contexts": ChunkOut(ctxs, many=True).data})
+    try:
+        result, ctxs = rag_answer(s.validated_data["question"], s.validated_data["k"],
+                                  per_doc_cap=s.validated_data.get("per_doc_cap"), **s.search_filters())
+    except LLMError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({"answer": result["answer"], "meta": result.get("meta", {}),
+                     "contexts": contexts_out(ctxs, lean=s.validated_data["lean"])})